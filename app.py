@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, send_file, url_for, after_this_request
+from flask import Flask, render_template, request, jsonify, send_file, url_for, after_this_request, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
 import os
@@ -7,16 +7,30 @@ from PIL import Image, ImageDraw, ImageFont
 import json
 import io
 import zipfile
+import zlib
+import hashlib
+import math
+import re
+import struct
 from datetime import datetime
 import tempfile
 import shutil
 from io import BytesIO
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import glob # Import glob for file matching
-import random
+import secrets
 import string
 import threading
 import time
+import sqlite3
+import multiprocessing
+import weakref
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -25,6 +39,59 @@ CORS(app)  # Enable CORS for all routes
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['SECRET_KEY'] = os.urandom(24)  # Generate a random secret key
+# Number of processes used to render large batches (1 renders in-process). By
+# default the CPUs are split between gunicorn's worker processes (WEB_CONCURRENCY)
+_cpus_per_web_worker = max(1, (os.cpu_count() or 1) // max(1, int(os.environ.get('WEB_CONCURRENCY', 1))))
+app.config['RENDER_WORKERS'] = int(os.environ.get('RENDER_WORKERS', _cpus_per_web_worker))
+# Render processes this server process runs at once across all of its jobs;
+# jobs that find none free render in-process
+app.config['RENDER_PROCESS_LIMIT'] = int(os.environ.get('RENDER_PROCESS_LIMIT', _cpus_per_web_worker))
+# Number of background jobs (batch renders, downloads) that run at once
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+# Seconds a finished job's status and result are kept
+app.config['JOB_RETENTION'] = int(os.environ.get('JOB_RETENTION', 3600))
+# Seconds an uploaded CSV/Excel dataset is kept after it was last used
+app.config['DATASET_RETENTION'] = int(os.environ.get('DATASET_RETENTION', 24 * 3600))
+# Deflate level (1-9) for archive members that aren't already compressed; 0 stores everything
+app.config['ZIP_COMPRESSION_LEVEL'] = int(os.environ.get('ZIP_COMPRESSION_LEVEL', 6))
+# Default encoder settings for rendered rows (see parse_output_format); requests
+# can override them with an 'output' object. Previews favour speed over size.
+app.config['PREVIEW_OUTPUT'] = {
+    'format': os.environ.get('PREVIEW_OUTPUT_FORMAT', 'png'),
+    'compress_level': int(os.environ.get('PREVIEW_PNG_COMPRESS_LEVEL', 1))
+}
+app.config['DOWNLOAD_OUTPUT'] = {
+    'format': os.environ.get('DOWNLOAD_OUTPUT_FORMAT', 'png'),
+    'quality': int(os.environ.get('DOWNLOAD_OUTPUT_QUALITY', 90)),
+    'compress_level': int(os.environ.get('DOWNLOAD_PNG_COMPRESS_LEVEL', 6))
+}
+# Size limit (bytes) of the on-disk cache of downloaded overlay images
+app.config['IMAGE_CACHE_MAX_BYTES'] = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Seconds a cached image is used without revalidating, unless the server sends max-age
+app.config['IMAGE_CACHE_TTL'] = int(os.environ.get('IMAGE_CACHE_TTL', 3600))
+# Concurrent downloads when prefetching a job's overlay images, in total and per host
+app.config['IMAGE_PREFETCH_WORKERS'] = int(os.environ.get('IMAGE_PREFETCH_WORKERS', 16))
+app.config['IMAGE_PREFETCH_PER_HOST'] = int(os.environ.get('IMAGE_PREFETCH_PER_HOST', 6))
+# How many rows ahead of the renderer images are prefetched (bounds memory use)
+app.config['IMAGE_PREFETCH_LOOKAHEAD'] = int(os.environ.get('IMAGE_PREFETCH_LOOKAHEAD', 64))
+# Memory budget for decoded, resized overlays kept between rows and requests
+app.config['OVERLAY_CACHE_MAX_BYTES'] = int(os.environ.get('OVERLAY_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# Memory each process of a job may hold in overlays pinned for rows still to come
+app.config['OVERLAY_PIN_MAX_BYTES'] = int(os.environ.get('OVERLAY_PIN_MAX_BYTES', 64 * 1024 * 1024))
+# Memory budget for rasterised text lines (glyph-run masks) reused between rows
+app.config['GLYPH_CACHE_MAX_BYTES'] = int(os.environ.get('GLYPH_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Keep-alive connection pools for image downloads: how many hosts get a pool,
+# and how many connections each host's pool keeps open
+app.config['HTTP_POOL_CONNECTIONS'] = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+app.config['HTTP_POOL_MAXSIZE'] = int(os.environ.get('HTTP_POOL_MAXSIZE', 16))
+# Retries for connection errors and 429/5xx answers, with exponential backoff (seconds)
+app.config['HTTP_RETRIES'] = int(os.environ.get('HTTP_RETRIES', 3))
+app.config['HTTP_RETRY_BACKOFF'] = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.3))
+# Batches smaller than this are rendered in-process, since starting a pool costs more
+app.config['PARALLEL_RENDER_MIN_ROWS'] = int(os.environ.get('PARALLEL_RENDER_MIN_ROWS', 32))
+# Render rows on one reused canvas per job, restoring only the areas the previous
+# row drew on, instead of copying the whole template for every row
+app.config['DIRTY_REGION_RENDERING'] = os.environ.get('DIRTY_REGION_RENDERING', 'true').lower() == 'true'
 
 # Ensure required directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -34,11 +101,224 @@ os.makedirs(os.path.join('static', 'fonts'), exist_ok=True)
 
 # Font management
 FONTS_DIR = os.path.join('static', 'fonts')
-DEFAULT_FONT = os.path.join(FONTS_DIR, 'arial.ttf')
+DEFAULT_FONT = os.path.join(FONTS_DIR, 'Arial.ttf')
 
-# Global variables to track progress
-preview_progress = {"percent": 0, "status": "idle"}
-download_progress = {"percent": 0, "status": "idle"}
+class LRUCache:
+    """Thread-safe least recently used cache with hit, miss and eviction counters.
+    
+    Bounded by max_entries, by max_bytes (a callable, so config changes apply)
+    as measured by sizeof, or both. Entries stored with a ttl expire after it.
+    """
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            self._remove(key)
+            entry = None
+        return entry
+    
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+    
+    def __contains__(self, key):
+        """Check for an unexpired entry without counting a lookup."""
+        with self._lock:
+            return self._live_entry(key) is not None
+    
+    def get(self, key, stats=None):
+        """Return the value for key, or None. stats, if given, is counted too."""
+        with self._lock:
+            entry = self._live_entry(key)
+            outcome = "hits" if entry is not None else "misses"
+            self.stats[outcome] += 1
+            if stats is not None:
+                stats[outcome] += 1
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+    
+    def put(self, key, value, ttl=None):
+        size = self.sizeof(value) if self.sizeof else 0
+        max_bytes = self.max_bytes() if self.max_bytes else None
+        if max_bytes is not None and size > max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time() + ttl if ttl is not None else None, size)
+            self.bytes += size
+            while ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                   or (max_bytes is not None and self.bytes > max_bytes)):
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+    
+    def get_or_load(self, key, load, stats=None):
+        """Return the value for key, calling load() to create it on a miss."""
+        value = self.get(key, stats)
+        if value is None:
+            # Load outside the lock so other threads are not blocked
+            value = load()
+            self.put(key, value)
+        return value
+    
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._remove(key)
+            return entry[0] if entry is not None else None
+    
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+# Loaded FreeType fonts, keyed by (path, size) and shared by all requests
+FONT_CACHE_SIZE = 64
+_font_cache = LRUCache(max_entries=FONT_CACHE_SIZE)
+font_cache_stats = _font_cache.stats
+
+# Font sizes accepted from the client; auto-fit boxes never shrink below the minimum
+MIN_FONT_SIZE = 8
+MAX_FONT_SIZE = 200
+
+# Measured text widths for word wrapping, per font. Fonts are weak keys so a
+# font evicted from _font_cache takes its widths with it.
+TEXT_WIDTH_CACHE_SIZE = 4096
+_text_width_cache = weakref.WeakKeyDictionary()
+
+# Latin-1 advance-width tables (see AdvanceTable) per font and font mode, and
+# whether each font file has a 'kern' table, by path
+_advance_tables = weakref.WeakKeyDictionary()
+_advance_tables_lock = threading.Lock()
+_font_kerning = {}
+
+# Finished text box layouts (wrapped lines and their widths), keyed by text,
+# font and wrap width, so values repeated across rows skip measuring
+LAYOUT_CACHE_SIZE = 2048
+_layout_cache = LRUCache(max_entries=LAYOUT_CACHE_SIZE)
+layout_cache_stats = _layout_cache.stats
+
+# Rasterised text lines as (mask, offset) from FreeType, keyed by the line,
+# font, stroke width and the sub-pixel start position, and evicted least
+# recently used first once the masks pass GLYPH_CACHE_MAX_BYTES
+_glyph_cache = LRUCache(max_bytes=lambda: app.config['GLYPH_CACHE_MAX_BYTES'],
+                        sizeof=lambda run: run[0].width * run[0].height)
+glyph_cache_stats = _glyph_cache.stats
+
+# Decoded templates keyed by (path, mtime, size), so a re-uploaded template is
+# never served stale. Images are already in their working mode (see
+# to_working_mode) and must be treated as read-only; render_row works on a copy.
+TEMPLATE_CACHE_SIZE = 4
+_template_cache = LRUCache(max_entries=TEMPLATE_CACHE_SIZE)
+template_cache_stats = _template_cache.stats
+
+def _private_dir(path):
+    """Create a directory only this user can access, refusing one someone else owns."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if hasattr(os, 'getuid') and (not os.path.isdir(path) or os.path.islink(path) or info.st_uid != os.getuid()):
+        raise RuntimeError(f'{path} is not a directory owned by this user')
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+def _private_temp_dir(name):
+    """Return this user's own directory called name in the temp directory, creating it if needed."""
+    path = os.path.join(tempfile.gettempdir(), name)
+    if hasattr(os, 'getuid'):
+        # Per user, so another account can't have created it first
+        path += f'_{os.getuid()}'
+    return _private_dir(path)
+
+# CSV/Excel data kept server-side so the browser never posts it back. The
+# uploaded file is stored as-is so every gunicorn worker can parse it again,
+# and the most recently used parsed datasets are also kept in memory. Files
+# are removed DATASET_RETENTION seconds after they were last used.
+DATASETS_DIR = _private_temp_dir('data_merge_datasets')
+DATASET_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+DATASET_CACHE_SIZE = 4
+_datasets = LRUCache(max_entries=DATASET_CACHE_SIZE)
+
+# Downloaded overlay images. Bodies are stored once per content hash under
+# blobs/, and each URL has a small JSON record under urls/ with its hash and
+# ETag/Last-Modified validators. Record mtimes double as LRU access times.
+IMAGE_CACHE_DIR = _private_temp_dir('data_merge_image_cache')
+os.makedirs(os.path.join(IMAGE_CACHE_DIR, 'blobs'), exist_ok=True)
+os.makedirs(os.path.join(IMAGE_CACHE_DIR, 'urls'), exist_ok=True)
+_image_cache_lock = threading.Lock()
+# Bytes of blobs/ as last scanned plus what this process has stored since;
+# None until the first store. Other workers' writes only show up at the next
+# scan, which runs whenever this total passes IMAGE_CACHE_MAX_BYTES.
+_image_cache_bytes = None
+# Unreferenced blobs younger than this may belong to a store in progress
+IMAGE_BLOB_GRACE = 60
+# Eviction frees down to this fraction of the limit, so a full cache is
+# rescanned every few stores rather than on each one
+IMAGE_CACHE_EVICT_TO = 0.9
+image_cache_stats = {"hits": 0, "misses": 0, "revalidated": 0, "stale": 0, "evictions": 0}
+
+# Overlays decoded and resized to fit a box, ready to paste, keyed by
+# (URL, box width, box height, resample filter). Entries are evicted least
+# recently used first once their pixel data passes OVERLAY_CACHE_MAX_BYTES,
+# and are trusted for IMAGE_CACHE_TTL like a fresh downloaded image.
+OVERLAY_RESAMPLE = Image.Resampling.LANCZOS
+# Big downscales shrink by an integer factor with Image.reduce() first and
+# finish with OVERLAY_RESAMPLE from at least this many times the target size
+OVERLAY_REDUCING_GAP = 3.0
+_overlay_cache = LRUCache(max_bytes=lambda: app.config['OVERLAY_CACHE_MAX_BYTES'],
+                          sizeof=lambda prepared: _overlay_nbytes(prepared))
+overlay_cache_stats = _overlay_cache.stats
+
+# HTTP connection pools for image downloads. One adapter (and so one set of
+# per-host pools) is shared by the whole process; each thread gets its own
+# Session on top of it, since Session state such as cookies isn't thread-safe.
+_http_adapter = None
+_http_adapter_lock = threading.Lock()
+_http_local = threading.local()
+
+# Formats that are already compressed; deflating them again costs CPU for no gain
+PRECOMPRESSED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.gif', '.zip'}
+
+# Streaming zip downloads registered by /render_zip and waiting to be fetched
+STREAMS_DIR = _private_temp_dir('data_merge_streams')
+
+# Render processes currently running for jobs in this process (see RENDER_PROCESS_LIMIT)
+_render_processes = 0
+_render_processes_lock = threading.Lock()
+
+# Background jobs, keyed by job ID
+jobs = {}
+jobs_lock = threading.Lock()
+job_executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'])
+
+# Job status and progress live in SQLite so every gunicorn worker sees the same state
+PROGRESS_DB = os.path.join(_private_temp_dir('data_merge_progress'), 'progress.sqlite3')
+PROGRESS_WRITE_INTERVAL = 0.25  # Minimum seconds between progress writes for a job
+_progress_local = threading.local()
+# Notified whenever this process saves job state, so event streams can push it right away
+job_progress_changed = threading.Condition()
+# Seconds an event stream waits between checks for updates written by other processes
+JOB_EVENTS_POLL_INTERVAL = 0.5
+# Seconds an event stream waits for a job that hasn't been registered yet
+JOB_EVENTS_WAIT_FOR_JOB = 10
 
 # Ensure fonts directory exists
 os.makedirs(FONTS_DIR, exist_ok=True)
@@ -123,6 +403,37 @@ def get_font_path(font_name, bold=False, italic=False):
     
     return font_path
 
+def load_font(font_path, font_size):
+    """Return a FreeType font for the given path and size, loading it at most once."""
+    return _font_cache.get_or_load((font_path, font_size), lambda: ImageFont.truetype(font_path, font_size))
+
+def to_working_mode(template_img):
+    """Convert a template to the mode a job renders in.
+    
+    Templates with transparency render in RGBA and everything else in RGB.
+    Text colours are opaque and overlays are composited through their own
+    masks, so no box type needs an alpha channel the template doesn't have.
+    """
+    if template_img.mode in ('RGB', 'RGBA'):
+        return template_img
+    has_alpha = 'A' in template_img.getbands() or 'transparency' in template_img.info
+    return template_img.convert('RGBA' if has_alpha else 'RGB')
+
+def load_template(template_path):
+    """Return the decoded template at template_path, decoding it at most once per version."""
+    stat = os.stat(template_path)
+    key = (os.path.abspath(template_path), stat.st_mtime_ns, stat.st_size)
+    template_img = _template_cache.get(key)
+    if template_img is None:
+        template_img = to_working_mode(Image.open(template_path))
+        template_img.load()
+        # Older versions of the same file can't be asked for again
+        for old_key in _template_cache.keys():
+            if old_key[0] == key[0]:
+                _template_cache.pop(old_key)
+        _template_cache.put(key, template_img)
+    return template_img
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -153,6 +464,12 @@ def upload_template():
     # Save the new template file
     file.save(filepath)
     
+    # Decode it now so the first preview doesn't have to
+    try:
+        load_template(filepath)
+    except Exception as e:
+        print(f"Warning: Could not pre-load template {filepath}: {e}")
+    
     # Return the URL for the uploaded image
     image_url = url_for('static', filename=f'uploads/{filename}')
     return jsonify({
@@ -172,62 +489,260 @@ def upload_csv():
     
     try:
         # Check file extension to determine if it's CSV or Excel
-        if file.filename.lower().endswith('.csv'):
-            # For CSV files, use encoding='utf-8-sig' to handle BOM and other encoding issues
-            df = pd.read_csv(file, encoding='utf-8-sig', on_bad_lines='skip')
-        elif file.filename.lower().endswith(('.xlsx', '.xls')):
-            # For Excel files
-            df = pd.read_excel(file)
-        else:
+        extension = os.path.splitext(file.filename.lower())[1]
+        if extension not in DATASET_EXTENSIONS:
             return jsonify({'error': 'Unsupported file format. Please upload a CSV or Excel file'}), 400
         
+        data = file.read()
+        df = parse_dataset(data, extension)
+        dataset_id = save_dataset(data, extension, df)
+        
         preview_rows = min(20, len(df))  # Show up to 20 rows in preview
         return jsonify({
+            'dataset_id': dataset_id,
             'columns': df.columns.tolist(),
             'preview': df.head(preview_rows).to_dict('records'),
-            'all_data': df.to_dict('records'),  # Send all rows
             'total_rows': len(df)
         })
     except Exception as e:
         return jsonify({'error': f"Error reading file: {str(e)}"}), 400
 
+def parse_dataset(data, extension):
+    """Parse the bytes of an uploaded CSV or Excel file into a DataFrame."""
+    if extension == '.csv':
+        # For CSV files, use encoding='utf-8-sig' to handle BOM and other encoding issues
+        df = pd.read_csv(BytesIO(data), encoding='utf-8-sig', on_bad_lines='skip')
+    else:
+        # For Excel files
+        df = pd.read_excel(BytesIO(data))
+    # Empty cells become None so they serialize as null and are skipped when rendering
+    return df.astype(object).where(pd.notna(df), None)
+
+def _dataset_path(dataset_id):
+    """Return the stored file of a dataset ID, or None if the ID is malformed or unknown."""
+    if not dataset_id or not str(dataset_id).isalnum():
+        return None
+    for extension in DATASET_EXTENSIONS:
+        path = os.path.join(DATASETS_DIR, f'{dataset_id}{extension}')
+        if os.path.exists(path):
+            return path
+    return None
+
+def _remember_dataset(dataset_id, df):
+    """Keep a dataset in the in-memory LRU."""
+    _datasets.put(dataset_id, df)
+
+def save_dataset(data, extension, df):
+    """Store an uploaded file and its parsed DataFrame; return the dataset ID."""
+    dataset_id = generate_unique_id(16)
+    _write_atomic(os.path.join(DATASETS_DIR, f'{dataset_id}{extension}'), data)
+    _remember_dataset(dataset_id, df)
+    return dataset_id
+
+def load_dataset(dataset_id):
+    """Return the DataFrame stored under dataset_id, or None if it doesn't exist or has expired."""
+    path = _dataset_path(dataset_id)
+    if path is None:
+        _datasets.pop(dataset_id)
+        return None
+    # Mark the file used so _prune_jobs keeps it for another DATASET_RETENTION
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    
+    df = _datasets.get(dataset_id)
+    if df is not None:
+        return df
+    
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    df = parse_dataset(data, os.path.splitext(path)[1])
+    _remember_dataset(dataset_id, df)
+    return df
+
+def get_dataset_rows(dataset_id, start=0, end=None):
+    """Return rows [start, end) of a stored dataset as a list of dicts, or None."""
+    df = load_dataset(dataset_id)
+    if df is None:
+        return None
+    return df.iloc[start:end].to_dict('records')
+
+def get_request_rows(data, limit=None):
+    """Resolve the rows a render request refers to.
+    
+    Requests either name a stored dataset ('dataset_id' plus an optional
+    'start'/'end' row range) or, for older clients, post 'csv_data' inline.
+    Raises LookupError if the dataset ID is unknown.
+    """
+    start = max(0, int(data.get('start') or 0))
+    end = data.get('end')
+    end = int(end) if end is not None else None
+    if limit is not None:
+        end = start + limit if end is None else min(end, start + limit)
+    
+    dataset_id = data.get('dataset_id')
+    if dataset_id:
+        rows = get_dataset_rows(dataset_id, start, end)
+        if rows is None:
+            raise LookupError(f'Dataset not found: {dataset_id}')
+        return rows
+    return data.get('csv_data', [])[start:end]
+
+def font_has_kerning(font_path):
+    """Check whether a TrueType/OpenType file has a 'kern' table.
+    
+    Pillow's basic layout only applies kerning from that table. Files that
+    can't be read as a single font are assumed to have one.
+    """
+    has_kerning = _font_kerning.get(font_path)
+    if has_kerning is None:
+        has_kerning = True
+        try:
+            with open(font_path, 'rb') as f:
+                header = f.read(12)
+                if header[:4] in (b'\x00\x01\x00\x00', b'true', b'OTTO'):
+                    num_tables = struct.unpack('>H', header[4:6])[0]
+                    records = f.read(16 * num_tables)
+                    tags = {records[i:i + 4] for i in range(0, len(records), 16)}
+                    has_kerning = b'kern' in tags
+        except (OSError, TypeError, struct.error):
+            pass
+        _font_kerning[font_path] = has_kerning
+    return has_kerning
+
+class AdvanceTable:
+    """Advance widths of the Latin-1 characters in one font and font mode.
+    
+    With Pillow's basic layout a string's length is the sum of its glyph
+    advances plus the kerning between neighbouring glyphs, all in whole
+    1/64 pixels, so summing table entries gives exactly what
+    draw.textlength returns. Kerning pairs are measured the first time
+    they are seen. The table doesn't keep a reference to its font.
+    """
+    def __init__(self, font, mode):
+        self.advances = {chr(code): font.getlength(chr(code), mode=mode) for code in range(0x20, 0x100)}
+        self.kerning = {} if font_has_kerning(font.path) else None
+    
+    def measure(self, font, mode, text):
+        width = sum(map(self.advances.__getitem__, text))
+        if self.kerning is not None and len(text) > 1:
+            kerning = self.kerning
+            for pair in map(''.join, zip(text, text[1:])):
+                adjustment = kerning.get(pair)
+                if adjustment is None:
+                    adjustment = kerning[pair] = (font.getlength(pair, mode=mode)
+                                                  - self.advances[pair[0]] - self.advances[pair[1]])
+                width += adjustment
+        return width
+
+def text_length(draw, text, font):
+    """Return draw.textlength(text), using the font's AdvanceTable when possible.
+    
+    The fast path covers printable Latin-1 text in fonts using the basic
+    layout engine; anything else (other scripts, control characters, raqm
+    shaping) is measured by FreeType as before.
+    """
+    if (not text or font.layout_engine != ImageFont.Layout.BASIC
+            or not text.isprintable() or max(text) > '\xff'):
+        return draw.textlength(text, font=font)
+    
+    mode = draw.fontmode
+    tables = _advance_tables.get(font)
+    table = tables.get(mode) if tables is not None else None
+    if table is None:
+        # Built once per font and mode; 224 single-glyph measurements
+        table = AdvanceTable(font, mode)
+        with _advance_tables_lock:
+            _advance_tables.setdefault(font, {})[mode] = table
+    return table.measure(font, mode, text)
+
+def measure_text(draw, text, font):
+    """Return draw.textlength(text), memoised per font."""
+    widths = _text_width_cache.get(font)
+    if widths is None:
+        widths = _text_width_cache.setdefault(font, {})
+    key = (draw.fontmode, text)
+    width = widths.get(key)
+    if width is None:
+        if len(widths) >= TEXT_WIDTH_CACHE_SIZE:
+            widths.clear()
+        width = widths[key] = text_length(draw, text, font)
+    return width
+
+def _split_long_word(draw, word, font, max_width):
+    """Break a word that doesn't fit on a line of its own into chunks.
+    
+    Returns (chunks, remainder): chunks are complete lines, remainder starts
+    the next line (empty if nothing is left). Each chunk is the longest run
+    of characters that fits, found by binary search; as before, a chunk
+    always keeps its first character, and characters that are too wide on
+    their own at the start of the word get a line each.
+    """
+    chunks = []
+    start = 0
+    while start < len(word) and measure_text(draw, word[start], font) > max_width:
+        chunks.append(word[start])
+        start += 1
+    
+    while start < len(word):
+        # Longest word[start:end] that fits, keeping at least one character
+        low, high = start + 1, len(word)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if text_length(draw, word[start:mid], font) <= max_width:
+                low = mid
+            else:
+                high = mid - 1
+        if low == len(word):
+            return chunks, word[start:]
+        chunks.append(word[start:low])
+        start = low
+    return chunks, ''
+
 def wrap_text_to_width(draw, text, font, max_width):
-    """Helper function to wrap text based on given width"""
+    """Helper function to wrap text based on given width
+    
+    Each word and the space are measured once (and memoised per font), and
+    line widths are accumulated from them, so wrapping is linear in the
+    length of the text. The only difference from measuring whole lines is
+    kerning between a word and the space next to it, which isn't counted;
+    fonts with such kerning pairs (rare) can break a line a fraction of a
+    pixel differently.
+    """
     words = text.split()
     lines = []
     current_line = []
+    current_width = 0
     
     if not words:
         return []
     
+    space_width = measure_text(draw, ' ', font)
     for word in words:
         # Try adding the word to the current line
-        test_line = current_line + [word]
-        test_width = draw.textlength(' '.join(test_line), font=font)
+        word_width = measure_text(draw, word, font)
+        test_width = current_width + space_width + word_width if current_line else word_width
         
         if test_width <= max_width:
             current_line.append(word)
+            current_width = test_width
         else:
             # If current line has words, add it to lines
             if current_line:
                 lines.append(' '.join(current_line))
                 current_line = [word]
+                current_width = word_width
             else:
                 # If a single word is too long, split it
-                chars = list(word)
-                current_chars = []
-                for char in chars:
-                    test_chars = current_chars + [char]
-                    if draw.textlength(''.join(test_chars), font=font) <= max_width:
-                        current_chars.append(char)
-                    else:
-                        if current_chars:
-                            lines.append(''.join(current_chars))
-                            current_chars = [char]
-                        else:
-                            lines.append(char)
-                if current_chars:
-                    current_line = [''.join(current_chars)]
+                chunks, remainder = _split_long_word(draw, word, font, max_width)
+                lines.extend(chunks)
+                if remainder:
+                    current_line = [remainder]
+                    current_width = text_length(draw, remainder, font)
     
     # Add the last line if there's anything left
     if current_line:
@@ -235,377 +750,2005 @@ def wrap_text_to_width(draw, text, font, max_width):
     
     return lines
 
-def draw_text_box(draw, box, text, img_width, img_height):
-    """Helper function to draw text box with proper wrapping and alignment"""
+class TextBoxPlan(NamedTuple):
+    """Resolved settings for a text box, shared by every row of a job."""
+    column: str
+    x: float
+    y: float
+    width: float
+    height: float
+    font: ImageFont.FreeTypeFont
+    font_size: int
+    stroke_width: int
+    color: tuple
+    bold: bool
+    underline: bool
+    align: str
+    wrap_width: float
+    line_spacing: float
+    font_path: str = None
+    auto_fit: bool = False  # Shrink the font until the text fits the box
+
+class ImageBoxPlan(NamedTuple):
+    """Resolved settings for an image box, shared by every row of a job."""
+    column: str
+    x: float
+    y: float
+    width: float
+    height: float
+
+def str_to_bool(val):
+    """Convert string 'true'/'false' (or a real bool) to a boolean."""
+    if isinstance(val, bool):
+        return val
+    return str(val).lower() == 'true'
+
+def parse_hex_color(color):
+    """Convert a '#rrggbb' color to an RGB tuple, defaulting to black."""
+    if not isinstance(color, str) or not color.startswith('#'):
+        color = '#000000'
+    hex_digits = color.lstrip('#')
+    if len(hex_digits) != 6:
+        raise ValueError(f"Invalid color '{color}'")
+    return tuple(int(hex_digits[i:i+2], 16) for i in (0, 2, 4))
+
+def compile_box(box):
+    """Validate a box config from the client and resolve it into a plan entry."""
+    column = box.get('column')
+    if not column:
+        raise ValueError('Box is missing a column')
+    
+    x = float(box.get('x', 0))
+    y = float(box.get('y', 0))
+    width = float(box.get('width', 100))
+    height = float(box.get('height', 100))
+    
+    if str_to_bool(box.get('isImage', False)):
+        return ImageBoxPlan(column, x, y, width, height)
+    
+    # Get font size and validate
+    font_size = int(float(box.get('fontSize', 24)))
+    if font_size < MIN_FONT_SIZE:
+        font_size = MIN_FONT_SIZE
+    elif font_size > MAX_FONT_SIZE:
+        font_size = MAX_FONT_SIZE
+    
+    bold = str_to_bool(box.get('bold', False))
+    italic = str_to_bool(box.get('italic', False))
+    underline = str_to_bool(box.get('underline', False))
+    
+    # Get the appropriate font file based on family and style
+    font_path = get_font_path(box.get('fontFamily', 'Arial'), bold, italic)
+    
+    align = box.get('align', 'left')
+    if align not in ('left', 'center', 'right'):
+        align = 'left'
+    
+    text_box = TextBoxPlan(
+        column=column,
+        x=x,
+        y=y,
+        width=width,
+        height=height,
+        font=None,
+        font_size=font_size,
+        stroke_width=0,
+        color=parse_hex_color(box.get('color', '#000000')),
+        bold=bold,
+        underline=underline,
+        align=align,
+        wrap_width=width,
+        line_spacing=font_size * 1.2,
+        font_path=font_path,
+        auto_fit=str_to_bool(box.get('autoFit', False))
+    )
+    return text_box_at_size(text_box, font_size)
+
+def text_box_at_size(box, font_size):
+    """Return a compiled text box with its font and size-dependent settings at font_size."""
+    # Use stroke only if we don't have a bold font variant and bold is requested
+    stroke_width = 0
+    if box.bold and box.font_path.lower().find('bd') == -1:
+        stroke_width = max(1, font_size // 30)  # Scale stroke width with font size
+    
+    return box._replace(
+        font=load_font(box.font_path, font_size),
+        font_size=font_size,
+        stroke_width=stroke_width,
+        wrap_width=box.width - (stroke_width * 2 if box.bold else 0),
+        line_spacing=font_size * 1.2
+    )
+
+def compile_render_plan(boxes):
+    """Compile the client's box list into an immutable render plan.
+    
+    Raises ValueError if any box is invalid, so bad configs are rejected
+    before a single row is rendered.
+    """
+    plan = []
+    for idx, box in enumerate(boxes):
+        try:
+            plan.append(compile_box(box))
+        except (TypeError, ValueError, AttributeError) as e:
+            raise ValueError(f"Invalid box {idx + 1}: {e}")
+    return tuple(plan)
+
+def get_text_layout(draw, box, text, stats=None):
+    """Return the wrapped lines of text for a text box as (line, width) pairs.
+    
+    Layouts are kept in a bounded LRU shared by all jobs. If stats is given,
+    its 'hits' and 'misses' counts are updated as well as the global ones.
+    """
+    font = box.font
+    key = (text, font.path, font.size, font.index, box.wrap_width, draw.fontmode)
+    
+    def layout():
+        lines = []
+        for line in wrap_text_to_width(draw, text, font, box.wrap_width):
+            # Calculate line width for alignment
+            bbox = draw.textbbox((0, 0), line, font=font)
+            lines.append((line, bbox[2] - bbox[0]))
+        return tuple(lines)
+    
+    return _layout_cache.get_or_load(key, layout, stats)
+
+def get_glyph_run(draw, text, font, start, stroke_width=0):
+    """Return the (mask, offset) FreeType renders for a line of text, rendering it at most once.
+    
+    start is the fractional part of the drawing position, which shifts the
+    anti-aliasing, so it is part of the key along with the font mode.
+    """
+    key = (text, font.path, font.size, font.index, draw.fontmode, stroke_width, start)
+    
+    def render():
+        mask, offset = font.getmask2(text, draw.fontmode, stroke_width=stroke_width, start=start)
+        return Image.Image()._new(mask), offset
+    
+    return _glyph_cache.get_or_load(key, render)
+
+def draw_text_line(draw, xy, text, font, color, stroke_width=0):
+    """Draw one line of text like draw.text, reusing cached glyph-run masks.
+    
+    Positions and masks are worked out exactly as ImageDraw.text does, so
+    the result is the same pixels. With a stroke, the stroked outline is
+    drawn first and the plain text over it, in the same colour.
+    """
+    x, y = xy
+    start = (math.modf(x)[0], math.modf(y)[0])
+    origin = (int(x), int(y))
+    for width in ((stroke_width, 0) if stroke_width else (0,)):
+        mask, offset = get_glyph_run(draw, text, font, start, width)
+        draw.bitmap((origin[0] + offset[0], origin[1] + offset[1]), mask, fill=color)
+
+def text_fits(draw, box, text, layout_stats=None):
+    """Check whether every wrapped line of text fits inside the box."""
+    layout = get_text_layout(draw, box, text, layout_stats)
+    if not layout:
+        return True
+    text_height = (len(layout) - 1) * box.line_spacing + box.font_size
+    return text_height <= box.height and all(line_width <= box.width for _, line_width in layout)
+
+def fit_text_box(draw, box, text, layout_stats=None):
+    """Return the box at the largest font size, up to its own, at which text fits.
+    
+    Sizes are binary searched between MIN_FONT_SIZE and the box's size, so
+    fitting takes O(log n) layouts; fonts, word widths and layouts all come
+    from their caches. Falls back to MIN_FONT_SIZE if nothing fits.
+    """
+    if text_fits(draw, box, text, layout_stats):
+        return box
+    
+    low, high = MIN_FONT_SIZE, box.font_size - 1
+    best = None
+    while low <= high:
+        mid = (low + high) // 2
+        candidate = text_box_at_size(box, mid)
+        if text_fits(draw, candidate, text, layout_stats):
+            best = candidate
+            low = mid + 1
+        else:
+            high = mid - 1
+    return best or text_box_at_size(box, MIN_FONT_SIZE)
+
+def draw_text_box(draw, box, text, layout_stats=None):
+    """Helper function to draw a compiled text box with proper wrapping and alignment
+    
+    Returns the font size used, which for auto-fit boxes depends on the text.
+    """
     try:
-        # Get font size and validate
-        font_size = int(box.get('fontSize', 24))
-        if font_size < 8:
-            font_size = 8
-        elif font_size > 200:
-            font_size = 200
-            
-        # Get font family and style
-        font_family = box.get('fontFamily', 'Arial')
+        if box.auto_fit:
+            box = fit_text_box(draw, box, text, layout_stats)
+        font = box.font
+        x, y = box.x, box.y
         
-        # Convert string 'true'/'false' to boolean
-        def str_to_bool(val):
-            if isinstance(val, bool):
-                return val
-            return str(val).lower() == 'true'
+        # Wrapped lines and their widths, measured once per distinct value
+        layout = get_text_layout(draw, box, text, layout_stats)
         
-        bold = str_to_bool(box.get('bold', False))
-        italic = str_to_bool(box.get('italic', False))
-        underline = str_to_bool(box.get('underline', False))
-        
-        # Get the appropriate font file based on family and style
-        font_path = get_font_path(font_family, bold, italic)
-        font = ImageFont.truetype(font_path, font_size)
-        
-        # Use stroke only if we don't have a bold font variant and bold is requested
-        stroke_width = 0
-        if bold and font_path.lower().find('bd') == -1:
-            stroke_width = max(1, font_size // 30)  # Scale stroke width with font size
-        
-        # Get box dimensions and position
-        x = float(box.get('x', 0))
-        y = float(box.get('y', 0))
-        box_width = float(box.get('width', img_width - x))
-        box_height = float(box.get('height', img_height - y))
-        
-        # Validate color
-        color = box.get('color', '#000000')
-        if not color.startswith('#'):
-            color = '#000000'
-        # Convert color from hex to RGB
-        color = tuple(int(color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
-        
-        # Wrap text to fit box width
-        lines = wrap_text_to_width(draw, text, font, box_width - (stroke_width * 2 if bold else 0))
-        
-        # Calculate line height and total text height
-        line_spacing = font_size * 1.2
-        total_height = len(lines) * line_spacing
-
         # Draw each line with proper alignment
         current_y = y # Start drawing directly from the box's top y
-        for line in lines:
-            # Calculate line width for alignment
-            bbox = draw.textbbox((0, 0), line, font=font)
-            line_width = bbox[2] - bbox[0]
-            
+        for line, line_width in layout:
             # Calculate x position based on alignment
             line_x = x
-            align = box.get('align', 'left')
+            if box.align == 'center':
+                line_x = x + (box.width - line_width) // 2
+            elif box.align == 'right':
+                line_x = x + box.width - line_width
             
-            if align == 'center':
-                line_x = x + (box_width - line_width) // 2
-            elif align == 'right':
-                line_x = x + box_width - line_width
-            
-            # Draw the line with stroke for bold simulation if needed
-            if stroke_width > 0:
-                # Draw the stroke
-                draw.text((line_x, current_y), line, font=font, fill=color, stroke_width=stroke_width, stroke_fill=color)
-            else:
-                draw.text((line_x, current_y), line, font=font, fill=color)
+            # Draw the line, with stroke for bold simulation if needed
+            draw_text_line(draw, (line_x, current_y), line, font, box.color, box.stroke_width)
             
             # Draw underline if specified
-            if underline:
-                underline_y = current_y + font_size
-                underline_width = max(1, font_size // 20)
-                if bold:
-                    underline_width = max(underline_width, stroke_width)
+            if box.underline:
+                underline_y = current_y + box.font_size
+                underline_width = max(1, box.font_size // 20)
+                if box.bold:
+                    underline_width = max(underline_width, box.stroke_width)
                 draw.line([(line_x, underline_y), (line_x + line_width, underline_y)],
-                         fill=color, width=underline_width)
+                         fill=box.color, width=underline_width)
             
-            current_y += line_spacing
+            current_y += box.line_spacing
             
             # Stop if we exceed box height
-            if current_y - y > box_height:
+            if current_y - y > box.height:
                 break
                 
     except Exception as e:
         print(f"Error drawing text box: {str(e)}")
         # Draw a red rectangle to indicate error
-        draw.rectangle([x, y, x + box_width, y + box_height], outline='red', width=2)
-        draw.text((x + 10, y + box_height/2), f"Error: {str(e)[:50]}...", fill='red')
+        draw.rectangle([box.x, box.y, box.x + box.width, box.y + box.height], outline='red', width=2)
+        draw.text((box.x + 10, box.y + box.height/2), f"Error: {str(e)[:50]}...", fill='red')
+    
+    return box.font_size
+
+def _write_atomic(path, data):
+    """Write a file so readers in other processes never see it half-written."""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _image_meta_path(url):
+    """Return the metadata path for a URL."""
+    url_key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(IMAGE_CACHE_DIR, 'urls', f'{url_key}.json')
+
+def _image_blob_path(content_hash):
+    """Return the path of a cached image body."""
+    return os.path.join(IMAGE_CACHE_DIR, 'blobs', content_hash)
 
-def draw_image_box(draw, box, image_url, img_width, img_height):
-    """Helper function to draw image from URL into a box"""
+def _image_cache_expiry(response):
+    """Work out until when a response may be used without revalidating."""
+    cache_control = response.headers.get('Cache-Control', '').lower()
+    if 'no-cache' in cache_control or 'no-store' in cache_control:
+        return time.time()
+    max_age = re.search(r'max-age=(\d+)', cache_control)
+    if max_age:
+        return time.time() + int(max_age.group(1))
+    return time.time() + app.config['IMAGE_CACHE_TTL']
+
+def _image_blob_sizes():
+    """Return the size of every blob in the cache, by content hash."""
+    blobs_dir = os.path.join(IMAGE_CACHE_DIR, 'blobs')
+    blob_sizes = {}
+    for name in os.listdir(blobs_dir):
+        if not name.endswith('.tmp'):
+            try:
+                blob_sizes[name] = os.path.getsize(os.path.join(blobs_dir, name))
+            except OSError:
+                pass
+    return blob_sizes
+
+def _image_records():
+    """Return (mtime, path, content_hash) for every URL record, oldest first."""
+    records = []
+    for meta_path in glob.glob(os.path.join(IMAGE_CACHE_DIR, 'urls', '*.json')):
+        try:
+            with open(meta_path) as f:
+                records.append((os.path.getmtime(meta_path), meta_path, json.load(f)['content_hash']))
+        except (OSError, ValueError, KeyError):
+            continue
+    records.sort()
+    return records
+
+def _remove_image_blob(content_hash):
+    """Delete a blob, returning how many bytes were freed."""
+    blob_path = _image_blob_path(content_hash)
+    try:
+        size = os.path.getsize(blob_path)
+        os.remove(blob_path)
+    except OSError:
+        return 0
+    return size
+
+def _store_cached_image(url, response):
+    """Save a 200 response body and its validators, then enforce the size limit."""
+    global _image_cache_bytes
+    content = response.content
+    content_hash = hashlib.sha256(content).hexdigest()
+    blob_path = _image_blob_path(content_hash)
+    meta_path = _image_meta_path(url)
     try:
-        # Get box dimensions and position
-        x = float(box['x'])
-        y = float(box['y'])
-        box_width = float(box.get('width', img_width - x))
-        box_height = float(box.get('height', img_height - y))
+        with open(meta_path) as f:
+            old_hash = json.load(f).get('content_hash')
+    except (OSError, ValueError):
+        old_hash = None
+    
+    with _image_cache_lock:
+        if _image_cache_bytes is None:
+            _image_cache_bytes = sum(_image_blob_sizes().values())
+        if not os.path.exists(blob_path):
+            _write_atomic(blob_path, content)
+            _image_cache_bytes += len(content)
+    meta = {
+        'url': url,
+        'content_hash': content_hash,
+        'size': len(content),
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'expires_at': _image_cache_expiry(response)
+    }
+    _write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+    
+    if old_hash and old_hash != content_hash:
+        # The URL's content changed; its old body goes unless another URL serves it
+        with _image_cache_lock:
+            if not any(h == old_hash for _, _, h in _image_records()):
+                _image_cache_bytes -= _remove_image_blob(old_hash)
+    
+    if _image_cache_bytes > app.config['IMAGE_CACHE_MAX_BYTES']:
+        evict_image_cache()
+
+def evict_image_cache(max_bytes=None):
+    """Drop least recently used images until the cache fits well within max_bytes.
+    
+    Blobs no URL record points to are removed first, then records are
+    evicted oldest-accessed first along with any blob they were the last
+    user of, until IMAGE_CACHE_EVICT_TO of max_bytes is used.
+    """
+    global _image_cache_bytes
+    if max_bytes is None:
+        max_bytes = app.config['IMAGE_CACHE_MAX_BYTES']
+    with _image_cache_lock:
+        blob_sizes = _image_blob_sizes()
+        records = _image_records()
+        references = {}
+        for _, _, content_hash in records:
+            references[content_hash] = references.get(content_hash, 0) + 1
+        
+        # Orphans, e.g. left behind by a worker that died mid-store
+        cutoff = time.time() - IMAGE_BLOB_GRACE
+        for content_hash in list(blob_sizes):
+            if content_hash not in references:
+                try:
+                    recent = os.path.getmtime(_image_blob_path(content_hash)) > cutoff
+                except OSError:
+                    recent = False
+                if not recent:
+                    _remove_image_blob(content_hash)
+                    del blob_sizes[content_hash]
+        total = sum(blob_sizes.values())
         
+        target = max_bytes * IMAGE_CACHE_EVICT_TO
+        for _, meta_path, content_hash in records:
+            if total <= target:
+                break
+            try:
+                os.remove(meta_path)
+            except OSError:
+                continue
+            image_cache_stats["evictions"] += 1
+            references[content_hash] -= 1
+            # Bodies are shared by every URL serving the same bytes
+            if references[content_hash] == 0 and content_hash in blob_sizes:
+                _remove_image_blob(content_hash)
+                total -= blob_sizes[content_hash]
+        _image_cache_bytes = total
+
+def _get_http_adapter():
+    """Return the process-wide pooling adapter, creating it on first use."""
+    global _http_adapter
+    with _http_adapter_lock:
+        if _http_adapter is None:
+            retries = Retry(total=app.config['HTTP_RETRIES'],
+                            backoff_factor=app.config['HTTP_RETRY_BACKOFF'],
+                            status_forcelist=(429, 500, 502, 503, 504),
+                            allowed_methods=frozenset(['GET']),
+                            # Hand the last answer back instead of raising, so it's treated like any non-200
+                            raise_on_status=False)
+            _http_adapter = HTTPAdapter(pool_connections=app.config['HTTP_POOL_CONNECTIONS'],
+                                        pool_maxsize=app.config['HTTP_POOL_MAXSIZE'],
+                                        max_retries=retries)
+        return _http_adapter
+
+def get_http_session():
+    """Return this thread's Session, which reuses the shared keep-alive pools."""
+    session = getattr(_http_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = _get_http_adapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _http_local.session = session
+    return session
+
+def collect_http_stats():
+    """Return connection and request counts for each host's connection pool."""
+    if _http_adapter is None:
+        return {}
+    pools = _http_adapter.poolmanager.pools
+    stats = {}
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        host = f'{key.key_scheme}://{key.key_host}:{key.key_port}'
+        stats[host] = {
+            'connections_opened': pool.num_connections,
+            'requests': pool.num_requests
+        }
+    return stats
+
+def fetch_image_bytes(url, timeout=5):
+    """Return the body of an image URL, using the on-disk cache where possible.
+    
+    Fresh entries are served without touching the network; stale ones are
+    revalidated with a conditional GET. Returns None if the server answers
+    with anything other than 200 (or 304 for a cached entry). Network errors
+    and 429/5xx answers fall back to a stale cached copy when there is one.
+    """
+    meta_path = _image_meta_path(url)
+    meta = None
+    cached = None
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(_image_blob_path(meta['content_hash']), 'rb') as f:
+            cached = f.read()
+    except (OSError, ValueError, KeyError):
+        meta = None
+    
+    if cached is not None:
+        # Touch the record so eviction sees it as recently used
         try:
-            # Download and open the image from URL
-            response = requests.get(image_url, timeout=5)
-            if response.status_code == 200:
-                overlay_img = Image.open(BytesIO(response.content))
-                
-                # Calculate dimensions while maintaining aspect ratio
-                overlay_width, overlay_height = overlay_img.size
-                scale = min(box_width/overlay_width, box_height/overlay_height)
-                new_width = int(overlay_width * scale)
-                new_height = int(overlay_height * scale)
-                
-                # Resize the overlay image
-                overlay_img = overlay_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                
-                # Position image at exact box coordinates - no centering adjustment
-                # This ensures the image appears exactly where the box is placed
-                paste_x = int(x)
-                paste_y = int(y)
+            os.utime(meta_path)
+        except OSError:
+            pass
+        if time.time() < meta.get('expires_at', 0):
+            image_cache_stats["hits"] += 1
+            return cached
+    
+    headers = {}
+    if cached is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    
+    try:
+        response = get_http_session().get(url, timeout=timeout, headers=headers)
+    except requests.RequestException:
+        if cached is not None:
+            image_cache_stats["stale"] += 1
+            return cached
+        raise
+    
+    if response.status_code == 304 and cached is not None:
+        image_cache_stats["revalidated"] += 1
+        meta['expires_at'] = _image_cache_expiry(response)
+        _write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+        return cached
+    
+    if cached is not None and (response.status_code == 429 or response.status_code >= 500):
+        # Retries ran out on a struggling server; a stale copy beats an error box
+        image_cache_stats["stale"] += 1
+        return cached
+    
+    image_cache_stats["misses"] += 1
+    if response.status_code != 200:
+        return None
+    _store_cached_image(url, response)
+    return response.content
+
+class ImagePrefetcher:
+    """Download a job's overlay images on a thread pool, up to IMAGE_PREFETCH_LOOKAHEAD rows ahead.
+    
+    At most IMAGE_PREFETCH_PER_HOST downloads per host run at once; a row's
+    images are dropped once it is released and no pending row needs them.
+    """
+    def __init__(self, row_urls, max_workers=None, per_host=None, lookahead=None):
+        self._row_urls = [set(urls) for urls in row_urls]
+        self._per_host = per_host or app.config['IMAGE_PREFETCH_PER_HOST']
+        self._lookahead = lookahead or app.config['IMAGE_PREFETCH_LOOKAHEAD']
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or app.config['IMAGE_PREFETCH_WORKERS'])
+        # Per host: downloads in flight, and (url, future) pairs waiting for a slot
+        self._host_active = {}
+        self._host_pending = {}
+        self._hosts_lock = threading.Lock()
+        self._closed = False
+        self._futures = {}
+        self._refs = {}
+        self._scheduled_rows = 0
+        self._schedule_through(self._lookahead - 1)
+    
+    def _queue(self, url):
+        """Return a future for url's body, starting the download if its host has a free slot."""
+        future = Future()
+        host = urlsplit(url).netloc
+        with self._hosts_lock:
+            if self._host_active.get(host, 0) >= self._per_host:
+                self._host_pending.setdefault(host, deque()).append((url, future))
+                return future
+            self._host_active[host] = self._host_active.get(host, 0) + 1
+        self._start(host, url, future)
+        return future
+    
+    def _start(self, host, url, future):
+        if not future.set_running_or_notify_cancel():
+            self._finished(host)
+            return
+        try:
+            download = self._executor.submit(fetch_image_bytes, url, timeout=5)
+        except RuntimeError as e:
+            # Closed while the URL was queued
+            future.set_exception(e)
+            return
+        download.add_done_callback(lambda done: self._downloaded(host, future, done))
+    
+    def _downloaded(self, host, future, download):
+        if download.cancelled():
+            # future is already running, so it can't be cancelled itself
+            future.set_exception(CancelledError())
+        elif download.exception() is not None:
+            future.set_exception(download.exception())
+        else:
+            future.set_result(download.result())
+        self._finished(host)
+    
+    def _finished(self, host):
+        """Free a host's slot and hand it to the next URL queued for that host."""
+        with self._hosts_lock:
+            pending = self._host_pending.get(host)
+            if not pending or self._closed:
+                self._host_active[host] -= 1
+                return
+            url, future = pending.popleft()
+        self._start(host, url, future)
+    
+    def _schedule_through(self, row_index):
+        """Start fetching every URL used by rows up to and including row_index."""
+        last_row = min(row_index, len(self._row_urls) - 1)
+        for idx in range(self._scheduled_rows, last_row + 1):
+            for url in self._row_urls[idx]:
+                self._refs[url] = self._refs.get(url, 0) + 1
+                if url not in self._futures:
+                    self._futures[url] = self._queue(url)
+        self._scheduled_rows = max(self._scheduled_rows, last_row + 1)
+    
+    def get_image(self, url):
+        """Return the body of url, waiting for its download if needed."""
+        future = self._futures.get(url)
+        if future is None:
+            return fetch_image_bytes(url, timeout=5)
+        return future.result()
+    
+    def images_for_rows(self, row_indexes):
+        """Collect the results for some rows into a PrefetchedImages mapping."""
+        images = PrefetchedImages()
+        for idx in row_indexes:
+            for url in self._row_urls[idx]:
+                try:
+                    images[url] = self.get_image(url)
+                except Exception as e:
+                    # Request exceptions don't always pickle, so pass the message on
+                    images[url] = RuntimeError(str(e))
+        return images
+    
+    def release_row(self, row_index):
+        """Mark a row as rendered and prefetch further ahead."""
+        for url in self._row_urls[row_index]:
+            self._refs[url] -= 1
+            if self._refs[url] == 0:
+                del self._refs[url]
+                del self._futures[url]
+        self._schedule_through(row_index + self._lookahead)
+    
+    def close(self):
+        with self._hosts_lock:
+            self._closed = True
+            pending = [future for queue in self._host_pending.values() for _, future in queue]
+            self._host_pending.clear()
+        for future in pending:
+            future.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class PrefetchedImages(dict):
+    """Prefetched image bodies (or fetch errors) keyed by URL, sent to render workers."""
+    def get_image(self, url):
+        if url not in self:
+            return fetch_image_bytes(url, timeout=5)
+        result = self[url]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+def collect_row_image_urls(plan, rows, mode=None):
+    """Return the image URLs each row needs, in row order.
+    
+    If mode is given, URLs whose overlay for every box is already in this
+    process's overlay LRU (in that mode) are left out.
+    """
+    image_boxes = [box for box in plan if isinstance(box, ImageBoxPlan)]
+    row_urls = []
+    for row in rows:
+        urls = []
+        for box in image_boxes:
+            url = row.get(box.column)
+            if not url or not isinstance(url, str):
+                continue
+            if mode is not None and overlay_is_cached((url, box.width, box.height, OVERLAY_RESAMPLE, mode)):
+                continue
+            urls.append(url)
+        row_urls.append(urls)
+    return row_urls
+
+def collect_cache_stats():
+    """Return hit/miss counters and hit rates for the caches in this process,
+    plus per-host HTTP connection counters."""
+    def with_hit_rate(stats, hit_keys=('hits',)):
+        stats = dict(stats)
+        hits = sum(stats[key] for key in hit_keys)
+        lookups = hits + stats['misses']
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else None
+        return stats
+    
+    return {
+        'fonts': with_hit_rate(font_cache_stats),
+        'layouts': with_hit_rate(layout_cache_stats),
+        'glyph_runs': dict(with_hit_rate(glyph_cache_stats), bytes=_glyph_cache.bytes, entries=len(_glyph_cache)),
+        'templates': with_hit_rate(template_cache_stats),
+        'images': with_hit_rate(image_cache_stats, ('hits', 'revalidated', 'stale')),
+        'overlays': dict(with_hit_rate(overlay_cache_stats), bytes=_overlay_cache.bytes,
+                         entries=len(_overlay_cache)),
+        'http': collect_http_stats()
+    }
+
+def _overlay_nbytes(prepared):
+    """Approximate memory held by an (overlay, mask) pair."""
+    overlay_img, mask = prepared
+    size = overlay_img.width * overlay_img.height * len(overlay_img.getbands())
+    if mask is not None:
+        size += mask.width * mask.height
+    return size
+
+def get_cached_overlay(key):
+    """Return a ready-to-paste (overlay, mask) pair from the LRU, or None."""
+    return _overlay_cache.get(key)
+
+def overlay_is_cached(key):
+    """Check whether the LRU holds an unexpired overlay for key, without counting a lookup."""
+    return key in _overlay_cache
+
+def cache_overlay(key, prepared):
+    """Add a resized overlay to the LRU, evicting old ones to stay within budget."""
+    # Trusted for IMAGE_CACHE_TTL like a fresh download; the image behind the URL may change
+    _overlay_cache.put(key, prepared, ttl=app.config['IMAGE_CACHE_TTL'])
+
+class OverlayCache:
+    """Resized overlays for the rows of one job.
+    
+    Lookups go to the process-wide overlay LRU. On top of that, (URL, box
+    size) pairs that more than one row of the job uses are pinned until
+    their last use, up to OVERLAY_PIN_MAX_BYTES, so they can't be evicted
+    between those rows. repeated_keys maps each such key to its use count.
+    """
+    def __init__(self, repeated_keys=None):
+        self._remaining = dict(repeated_keys or {})
+        self._overlays = {}
+        self._pinned_bytes = 0
+    
+    def lookup(self, key):
+        """Return (found, prepared); prepared is None if the URL gave no image."""
+        remaining = self._remaining.get(key)
+        if remaining is not None:
+            # One use fewer; the pin goes with the last one
+            if remaining > 1:
+                self._remaining[key] = remaining - 1
+            else:
+                del self._remaining[key]
+        if key in self._overlays:
+            prepared = self._overlays[key]
+            if key not in self._remaining:
+                del self._overlays[key]
+                if prepared is not None:
+                    self._pinned_bytes -= _overlay_nbytes(prepared)
+            return True, prepared
+        prepared = get_cached_overlay(key)
+        return prepared is not None, prepared
+    
+    def store(self, key, prepared):
+        if key in self._remaining:
+            size = _overlay_nbytes(prepared) if prepared is not None else 0
+            # Past the budget, later rows rely on the LRU like everything else
+            if self._pinned_bytes + size <= app.config['OVERLAY_PIN_MAX_BYTES']:
+                self._overlays[key] = prepared
+                self._pinned_bytes += size
+        if prepared is not None:
+            cache_overlay(key, prepared)
+
+def find_repeated_overlays(plan, rows, mode):
+    """Return the overlay keys (see OverlayCache) used by more than one row, with their use counts."""
+    image_boxes = [box for box in plan if isinstance(box, ImageBoxPlan)]
+    counts = Counter((row[box.column], box.width, box.height, OVERLAY_RESAMPLE, mode)
+                     for row in rows for box in image_boxes
+                     if row.get(box.column) and isinstance(row[box.column], str))
+    return {key: count for key, count in counts.items() if count > 1}
+
+def prepare_overlay(image_data, box_width, box_height, mode='RGB', resample=OVERLAY_RESAMPLE):
+    """Decode an overlay and resize it to fit the box, returning (overlay, mask or None).
+    
+    The overlay comes back in mode, the working mode of the image it will be
+    pasted into.
+    """
+    overlay_img = Image.open(BytesIO(image_data))
+    
+    # Calculate dimensions while maintaining aspect ratio
+    overlay_width, overlay_height = overlay_img.size
+    scale = min(box_width/overlay_width, box_height/overlay_height)
+    new_width = int(overlay_width * scale)
+    new_height = int(overlay_height * scale)
+    
+    # JPEGs can be decoded straight at 1/2, 1/4 or 1/8 scale; draft() picks
+    # the smallest one that is still at least the target size (no-op for
+    # other formats)
+    overlay_img.draft(overlay_img.mode, (new_width, new_height))
+    
+    # Resize the overlay image
+    overlay_img = overlay_img.resize((new_width, new_height), resample, reducing_gap=OVERLAY_REDUCING_GAP)
+    
+    # If the overlay has transparency, use it as mask
+    if overlay_img.mode in ('RGBA', 'LA'):
+        # Extract the alpha channel as mask
+        mask = overlay_img.split()[-1] if overlay_img.mode == 'RGBA' else overlay_img.split()[1]
+        # Drop the overlay's own alpha; the mask alone decides coverage
+        overlay_img = overlay_img.convert('RGB')
+        if mode != 'RGB':
+            overlay_img = overlay_img.convert(mode)
+        return overlay_img, mask
+    if overlay_img.mode != mode:
+        overlay_img = overlay_img.convert(mode)
+    return overlay_img, None
+
+def draw_image_box(draw, box, image_url, images=None, overlays=None, mode='RGB'):
+    """Helper function to draw image from URL into a compiled image box
+    
+    images is an optional ImagePrefetcher or PrefetchedImages holding the
+    already-downloaded body, and overlays the job's OverlayCache. Overlays
+    already in the cache are pasted without downloading or decoding anything.
+    The overlay is returned in mode, the working mode of the row image.
+    """
+    x, y = box.x, box.y
+    box_width, box_height = box.width, box.height
+    
+    try:
+        if overlays is None:
+            overlays = OverlayCache()
+        overlay_key = (image_url, box_width, box_height, OVERLAY_RESAMPLE, mode)
+        found, prepared = overlays.lookup(overlay_key)
+        if not found:
+            # Download (or load from the prefetcher/cache) and open the image from URL
+            if images is not None:
+                image_data = images.get_image(image_url)
+            else:
+                image_data = fetch_image_bytes(image_url, timeout=5)
+            prepared = prepare_overlay(image_data, box_width, box_height, mode) if image_data is not None else None
+            overlays.store(overlay_key, prepared)
+        
+        if prepared is not None:
+            overlay_img, mask = prepared
+            # Position image at exact box coordinates - no centering adjustment
+            # This ensures the image appears exactly where the box is placed
+            paste_x = int(x)
+            paste_y = int(y)
+            
+            if mask is not None:
+                return (overlay_img, (paste_x, paste_y), mask)
+            else:
+                return (overlay_img, (paste_x, paste_y))
                 
-                # If the overlay has transparency, use it as mask
-                if overlay_img.mode in ('RGBA', 'LA'):
-                    # Extract the alpha channel as mask
-                    mask = overlay_img.split()[-1] if overlay_img.mode == 'RGBA' else overlay_img.split()[1]
-                    # Convert to RGB for pasting
-                    overlay_img = overlay_img.convert('RGB')
-                    return (overlay_img, (paste_x, paste_y), mask)
+    except Exception as e:
+        print(f"Error processing image URL: {str(e)}")
+        # Draw an error placeholder
+        draw.rectangle([x, y, x + box_width, y + box_height], outline='red', width=2)
+        draw.text((x + 10, y + box_height/2), f"Image Error: {str(e)[:50]}...", fill='red')
+
+def _flatten_coords(xy):
+    """Turn [(x0, y0), (x1, y1)] or [x0, y0, x1, y1] into a flat list of numbers."""
+    coords = []
+    for item in xy:
+        if isinstance(item, (tuple, list)):
+            coords.extend(item)
+        else:
+            coords.append(item)
+    return coords
+
+class TrackingDraw(ImageDraw.ImageDraw):
+    """ImageDraw that records a bounding box for everything it draws.
+    
+    Only the calls render_row makes (text, bitmap, line, rectangle) are tracked. Boxes
+    are padded a little so anti-aliased edges are always covered.
+    """
+    def __init__(self, im, mode=None):
+        super().__init__(im, mode)
+        self.dirty = []
+    
+    def mark(self, x0, y0, x1, y1, pad=0):
+        self.dirty.append((math.floor(x0) - pad, math.floor(y0) - pad,
+                           math.ceil(x1) + pad, math.ceil(y1) + pad))
+    
+    def text(self, xy, text, **kwargs):
+        bbox = self.textbbox(xy, text, font=kwargs.get('font'), stroke_width=kwargs.get('stroke_width', 0))
+        self.mark(*bbox, pad=2)
+        return super().text(xy, text, **kwargs)
+    
+    def bitmap(self, xy, bitmap, **kwargs):
+        self.mark(xy[0], xy[1], xy[0] + bitmap.width, xy[1] + bitmap.height, pad=1)
+        return super().bitmap(xy, bitmap, **kwargs)
+    
+    def line(self, xy, **kwargs):
+        coords = _flatten_coords(xy)
+        pad = kwargs.get('width', 0) // 2 + 2
+        self.mark(min(coords[0::2]), min(coords[1::2]), max(coords[0::2]), max(coords[1::2]), pad=pad)
+        return super().line(xy, **kwargs)
+    
+    def rectangle(self, xy, **kwargs):
+        coords = _flatten_coords(xy)
+        self.mark(min(coords[0::2]), min(coords[1::2]), max(coords[0::2]), max(coords[1::2]), pad=2)
+        return super().rectangle(xy, **kwargs)
+
+def merge_regions(regions, size):
+    """Clip regions to an image of the given size and merge overlapping ones."""
+    width, height = size
+    merged = []
+    for x0, y0, x1, y1 in regions:
+        region = [max(0, x0), max(0, y0), min(width, x1), min(height, y1)]
+        if region[0] >= region[2] or region[1] >= region[3]:
+            continue
+        # Absorb every region this one overlaps, until nothing else overlaps
+        overlapped = True
+        while overlapped:
+            overlapped = False
+            for other in merged:
+                if (other[0] < region[2] and region[0] < other[2] and
+                        other[1] < region[3] and region[1] < other[3]):
+                    merged.remove(other)
+                    region = [min(region[0], other[0]), min(region[1], other[1]),
+                              max(region[2], other[2]), max(region[3], other[3])]
+                    overlapped = True
+                    break
+        merged.append(region)
+    return [tuple(region) for region in merged]
+
+class RowCanvas:
+    """One image a job's rows are drawn onto in turn, restoring only what the previous row changed.
+    
+    The image start_row() returns is only valid until the next call.
+    """
+    def __init__(self, template_img):
+        self.template = template_img
+        self.image = template_img.copy()
+        self.draw = None
+    
+    def start_row(self):
+        """Restore the template under the previous row's drawing; return (image, draw)."""
+        if self.draw is not None:
+            for region in merge_regions(self.draw.dirty, self.image.size):
+                self.image.paste(self.template.crop(region), region[:2])
+        self.draw = TrackingDraw(self.image)
+        return self.image, self.draw
+
+def render_row(template_img, plan, row, row_index=0, images=None, overlays=None, canvas=None,
+               layout_stats=None, fitted_sizes=None):
+    """Render one data row onto a copy of the template using a compiled plan.
+    
+    template_img must already be in its working mode (see to_working_mode).
+    If a RowCanvas for the template is given, the row is drawn onto it
+    instead of onto a fresh copy. layout_stats collects text layout cache
+    hits and misses (see get_text_layout), and fitted_sizes the font size
+    chosen for each auto-fit box, by the box's index in the plan.
+    """
+    if canvas is not None:
+        img, draw = canvas.start_row()
+    else:
+        # Create a copy of template for each row
+        img = template_img.copy()
+        draw = ImageDraw.Draw(img)
+    
+    # Process each box (can be text or image)
+    for box_index, box in enumerate(plan):
+        if box.column not in row:
+            print(f"Warning: Column '{box.column}' not found in CSV row {row_index}")
+            continue
+        
+        value = row[box.column]
+        if not value:  # Only draw if a value is provided
+            continue
+        
+        x, y, width, height = box.x, box.y, box.width, box.height
+        
+        if isinstance(box, ImageBoxPlan):
+            image_url = value
+            try:
+                # For image boxes, use the dedicated function
+                result = draw_image_box(draw, box, image_url, images, overlays, img.mode)
+                if result:
+                    # Overlays already come in the row's mode
+                    if len(result) == 3: # If mask is returned
+                        overlay, pos, mask = result
+                        # Paste using the mask
+                        img.paste(overlay, pos, mask)
+                    else: # No mask
+                        overlay, pos = result
+                        img.paste(overlay, pos)
+                    if canvas is not None:
+                        draw.mark(pos[0], pos[1], pos[0] + overlay.width, pos[1] + overlay.height)
                 else:
-                    return (overlay_img, (paste_x, paste_y))
-                    
-        except Exception as e:
-            print(f"Error processing image URL: {str(e)}")
-            # Draw an error placeholder
-            draw.rectangle([x, y, x + box_width, y + box_height], outline='red', width=2)
-            draw.text((x + 10, y + box_height/2), f"Image Error: {str(e)[:50]}...", fill='red')
-            
+                    # Draw error indication
+                    draw.rectangle([(x, y), (x + width, y + height)], outline='red', width=2)
+                    draw.text((x + 5, y + 5), "Image Error", fill='red', font=load_font(DEFAULT_FONT, 12))
+            except Exception as e:
+                print(f"Error drawing image from {image_url}: {str(e)}")
+                # Draw error box
+                draw.rectangle([(x, y), (x + width, y + height)], outline='red', width=2)
+                draw.text((x + 5, y + 5), f"Error: {str(e)[:30]}...", fill='red', font=load_font(DEFAULT_FONT, 12))
+        else:
+            # It's a text box
+            font_size = draw_text_box(draw, box, str(value), layout_stats)
+            if box.auto_fit and fitted_sizes is not None:
+                fitted_sizes[box_index] = font_size
+    
+    return img
+
+# Accepted output format names, mapped to Pillow format names
+OUTPUT_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'jpg': 'JPEG', 'webp': 'WEBP'}
+OUTPUT_EXTENSIONS = {'PNG': '.png', 'JPEG': '.jpg', 'WEBP': '.webp'}
+
+class OutputFormat(NamedTuple):
+    """Encoder settings for the rendered rows of a job."""
+    format: str = 'PNG'
+    quality: int = 90  # JPEG and WebP
+    compress_level: int = 6  # PNG
+    optimize: bool = False
+    
+    @property
+    def extension(self):
+        return OUTPUT_EXTENSIONS[self.format]
+
+def parse_output_format(options, defaults):
+    """Resolve a request's 'output' options on top of defaults into an OutputFormat.
+    
+    Raises ValueError for an unknown format or out-of-range settings.
+    """
+    settings = dict(defaults)
+    if options:
+        if not isinstance(options, dict):
+            raise ValueError('Output options must be an object')
+        settings.update({key: value for key, value in options.items() if value is not None})
+    
+    format_name = str(settings.get('format', 'png')).lower()
+    if format_name not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format '{format_name}'")
+    quality = int(settings.get('quality', 90))
+    if not 1 <= quality <= 100:
+        raise ValueError('Quality must be between 1 and 100')
+    compress_level = int(settings.get('compress_level', 6))
+    if not 0 <= compress_level <= 9:
+        raise ValueError('compress_level must be between 0 and 9')
+    return OutputFormat(OUTPUT_FORMATS[format_name], quality, compress_level,
+                        str_to_bool(settings.get('optimize', False)))
+
+def encode_image(img, output=None):
+    """Encode a rendered image with the given OutputFormat (PNG at default settings if None)."""
+    if output is None:
+        output = OutputFormat()
+    buffer = BytesIO()
+    if output.format == 'PNG':
+        img.save(buffer, format='PNG', compress_level=output.compress_level, optimize=output.optimize)
+    else:
+        if output.format == 'JPEG' and img.mode == 'RGBA':
+            # JPEG has no alpha channel, so flatten onto white
+            flattened = Image.new('RGB', img.size, (255, 255, 255))
+            flattened.paste(img, mask=img.getchannel('A'))
+            img = flattened
+        img.save(buffer, format=output.format, quality=output.quality, optimize=output.optimize)
+    return buffer.getvalue()
+
+# Per-process state for batch render workers, set once by _init_render_worker
+_worker_template = None
+_worker_plan = None
+_worker_overlays = None
+_worker_canvas = None
+_worker_output = None
+
+def _init_render_worker(template_img, plan, repeated_overlays=None, dirty_regions=False, output=None):
+    """Process pool initializer: keep the job's template and plan in the worker."""
+    global _worker_template, _worker_plan, _worker_overlays, _worker_canvas, _worker_output
+    _worker_template = template_img
+    _worker_plan = plan
+    _worker_output = output
+    _worker_overlays = OverlayCache(repeated_overlays)
+    _worker_canvas = RowCanvas(template_img) if dirty_regions else None
+
+def _render_worker_chunk(chunk, images=None):
+    """Render a chunk of (row_index, row) pairs inside a worker process.
+    
+    Returns the encoded images, the chunk's layout cache hits and misses, and
+    the auto-fit font sizes chosen for each row.
+    """
+    layout_stats = {"hits": 0, "misses": 0}
+    encoded = []
+    fitted_sizes = []
+    for idx, row in chunk:
+        row_sizes = {}
+        encoded.append(encode_image(render_row(_worker_template, _worker_plan, row, idx, images, _worker_overlays,
+                                               _worker_canvas, layout_stats, row_sizes), _worker_output))
+        fitted_sizes.append(row_sizes)
+    return encoded, layout_stats, fitted_sizes
+
+def reserve_render_processes(wanted):
+    """Claim up to wanted render processes under RENDER_PROCESS_LIMIT; return how many were granted."""
+    global _render_processes
+    with _render_processes_lock:
+        granted = max(0, min(wanted, app.config['RENDER_PROCESS_LIMIT'] - _render_processes))
+        _render_processes += granted
+        return granted
+
+def release_render_processes(count):
+    global _render_processes
+    with _render_processes_lock:
+        _render_processes -= count
+
+def render_rows(template_img, plan, rows, workers=None, chunk_size=4, cancel_event=None, output=None,
+                metrics=None, auto_fit_log=None):
+    """Render and encode rows with output, yielding (row_index, image_bytes) in row order.
+    
+    Large batches go to a process pool (within RENDER_PROCESS_LIMIT), a few
+    chunks at a time. Layout cache and auto-fit size counts are recorded in
+    metrics, per-row auto-fit sizes in auto_fit_log. Raises JobCancelled once
+    cancel_event is set.
+    """
+    def check_cancelled():
+        if cancel_event is not None and cancel_event.is_set():
+            raise JobCancelled()
+    
+    if workers is None:
+        workers = app.config['RENDER_WORKERS']
+    workers = max(1, min(workers, len(rows) // chunk_size or 1))
+    
+    # Pick the job's working mode once; rows and overlays are all produced in it
+    template_img = to_working_mode(template_img)
+    
+    in_process = workers == 1 or len(rows) < app.config['PARALLEL_RENDER_MIN_ROWS']
+    
+    prefetcher = None
+    repeated_overlays = {}
+    if any(isinstance(box, ImageBoxPlan) for box in plan):
+        # Overlays this process already has need no download; pool workers start empty
+        cached_mode = template_img.mode if in_process else None
+        prefetcher = ImagePrefetcher(collect_row_image_urls(plan, rows, cached_mode))
+        repeated_overlays = find_repeated_overlays(plan, rows, template_img.mode)
+    overlays = OverlayCache(repeated_overlays)
+    dirty_regions = app.config['DIRTY_REGION_RENDERING']
+    canvas = RowCanvas(template_img) if dirty_regions else None
+    layout_stats = {"hits": 0, "misses": 0}
+    auto_fit = any(getattr(box, 'auto_fit', False) for box in plan)
+    size_counts = None
+    if metrics is not None and auto_fit:
+        size_counts = metrics['auto_fit_size_counts'] = {}
+    
+    def record_layout_stats(chunk_stats=None):
+        if chunk_stats is not None:
+            layout_stats["hits"] += chunk_stats["hits"]
+            layout_stats["misses"] += chunk_stats["misses"]
+        if metrics is not None:
+            lookups = layout_stats["hits"] + layout_stats["misses"]
+            metrics['layout_cache_hits'] = layout_stats["hits"]
+            metrics['layout_cache_misses'] = layout_stats["misses"]
+            metrics['layout_cache_hit_rate'] = round(layout_stats["hits"] / lookups, 4) if lookups else None
+    
+    def record_fitted_sizes(idx, row_sizes):
+        if size_counts is not None:
+            for box_index, size in row_sizes.items():
+                # String keys, as they come back from JSON
+                counts = size_counts.setdefault(str(box_index), {})
+                counts[str(size)] = counts.get(str(size), 0) + 1
+        if auto_fit_log is not None and auto_fit:
+            auto_fit_log.add(idx, row_sizes)
+    
+    def render_here(idx, row):
+        row_sizes = {}
+        png = encode_image(render_row(template_img, plan, row, idx, prefetcher, overlays, canvas, layout_stats,
+                                      row_sizes), output)
+        if prefetcher is not None:
+            prefetcher.release_row(idx)
+        record_layout_stats()
+        record_fitted_sizes(idx, row_sizes)
+        return png
+    
+    def collect(first_idx, future):
+        encoded, chunk_stats, chunk_sizes = future.result()
+        record_layout_stats(chunk_stats)
+        for offset, row_sizes in enumerate(chunk_sizes):
+            record_fitted_sizes(first_idx + offset, row_sizes)
+        return encoded
+    
+    def render_in_process():
+        try:
+            for idx, row in enumerate(rows):
+                check_cancelled()
+                yield idx, render_here(idx, row)
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+            if auto_fit_log is not None:
+                auto_fit_log.flush()
+    
+    if not in_process:
+        workers = reserve_render_processes(workers)
+    if in_process or not workers:
+        # Other jobs hold every render process this server may start
+        yield from render_in_process()
+        return
+    
+    try:
+        # Make sure the template is decoded before it is pickled for the workers
+        template_img.load()
+        # Spawned workers don't inherit locks that other request threads might be holding
+        context = multiprocessing.get_context('spawn')
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                       initializer=_init_render_worker,
+                                       initargs=(template_img, plan, repeated_overlays, dirty_regions, output))
+    except BaseException:
+        release_render_processes(workers)
+        raise
+    indexed_rows = list(enumerate(rows))
+    chunks = (indexed_rows[i:i + chunk_size] for i in range(0, len(indexed_rows), chunk_size))
+    
+    def submit(chunk):
+        images = None
+        if prefetcher is not None:
+            # Workers get the chunk's downloaded images along with its rows
+            indexes = [idx for idx, _ in chunk]
+            images = prefetcher.images_for_rows(indexes)
+            for idx in indexes:
+                prefetcher.release_row(idx)
+        return executor.submit(_render_worker_chunk, chunk, images)
+    
+    try:
+        pending = deque()
+        max_pending = workers * 2
+        # Render the first chunk here before the workers are spawned, so the
+        # first results don't wait on process startup (streamed downloads
+        # start sending bytes right away)
+        for idx, row in next(chunks):
+            check_cancelled()
+            yield idx, render_here(idx, row)
+        
+        for chunk in chunks:
+            check_cancelled()
+            if len(pending) >= max_pending:
+                first_idx, future = pending.popleft()
+                for offset, data in enumerate(collect(first_idx, future)):
+                    yield first_idx + offset, data
+            pending.append((chunk[0][0], submit(chunk)))
+        while pending:
+            check_cancelled()
+            first_idx, future = pending.popleft()
+            for offset, data in enumerate(collect(first_idx, future)):
+                yield first_idx + offset, data
+    finally:
+        # Drop queued chunks if we stopped early (cancelled, failed or closed by the caller)
+        executor.shutdown(wait=True, cancel_futures=True)
+        release_render_processes(workers)
+        if prefetcher is not None:
+            prefetcher.close()
+        if auto_fit_log is not None:
+            auto_fit_log.flush()
+
+def generate_unique_id(length=8):
+    """Generate an unguessable random string of fixed length (IDs double as access tokens)."""
+    letters = string.ascii_lowercase + string.digits
+    return ''.join(secrets.choice(letters) for i in range(length))
+
+class JobCancelled(Exception):
+    """Raised inside a background job once it has been cancelled."""
+
+def check_job_cancelled(job):
+    """Raise JobCancelled if the given job has been cancelled."""
+    if job['cancel_event'].is_set():
+        raise JobCancelled()
+
+def _progress_db():
+    """Return this thread's connection to the shared progress database."""
+    conn = getattr(_progress_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(PROGRESS_DB, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # WAL lets status readers in other workers run alongside job writers
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_progress (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT,
+                status TEXT,
+                message TEXT,
+                percent REAL,
+                rows_done INTEGER,
+                rows_total INTEGER,
+                result TEXT,
+                error TEXT,
+                created_at REAL,
+                started_at REAL,
+                updated_at REAL,
+                finished_at REAL,
+                cancel_requested INTEGER DEFAULT 0,
+                metrics TEXT
+            )
+        """)
+        # Font sizes auto-fit boxes chose, one JSON {box_index: size} per row
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_auto_fit_sizes (
+                job_id TEXT,
+                row_index INTEGER,
+                sizes TEXT,
+                PRIMARY KEY (job_id, row_index)
+            )
+        """)
+        _progress_local.conn = conn
+    return conn
+
+def save_job_state(job):
+    """Write a job's status and progress to the shared store."""
+    job['saved_at'] = time.time()
+    _progress_db().execute("""
+        INSERT INTO job_progress (job_id, kind, status, message, percent, rows_done, rows_total,
+                                  result, error, created_at, started_at, updated_at, finished_at, metrics)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(job_id) DO UPDATE SET
+            status = excluded.status, message = excluded.message, percent = excluded.percent,
+            rows_done = excluded.rows_done, rows_total = excluded.rows_total,
+            result = excluded.result, error = excluded.error, started_at = excluded.started_at,
+            updated_at = excluded.updated_at, finished_at = excluded.finished_at,
+            metrics = excluded.metrics
+    """, (job['id'], job['kind'], job['status'], job['message'], job['percent'],
+          job['rows_done'], job['rows_total'],
+          json.dumps(job['result']) if job['result'] is not None else None,
+          job['error'], job['created_at'], job['started_at'], job['saved_at'], job['finished_at'],
+          json.dumps(job['metrics'])))
+    with job_progress_changed:
+        job_progress_changed.notify_all()
+
+class AutoFitLog:
+    """Record the font size each auto-fit box used in each row of a job.
+    
+    Rows are buffered and written to the job_auto_fit_sizes table in
+    batches, so per-row detail stays out of the job's metrics, which are
+    rewritten with every progress update.
+    """
+    def __init__(self, job_id, batch_size=256):
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self._rows = []
+    
+    def add(self, row_index, sizes):
+        self._rows.append((self.job_id, row_index, json.dumps(sizes)))
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        if self._rows:
+            _progress_db().executemany('INSERT OR REPLACE INTO job_auto_fit_sizes (job_id, row_index, sizes) '
+                                       'VALUES (?, ?, ?)', self._rows)
+            self._rows = []
+
+def load_auto_fit_sizes(job_id, start=0, end=None):
+    """Return [(row_index, {box_index: size})] recorded for a job's rows [start, end)."""
+    rows = _progress_db().execute(
+        'SELECT row_index, sizes FROM job_auto_fit_sizes WHERE job_id = ? AND row_index >= ? AND row_index < ? '
+        'ORDER BY row_index', (job_id, start, end if end is not None else 2 ** 62)).fetchall()
+    return [(row['row_index'], json.loads(row['sizes'])) for row in rows]
+
+def load_job_state(job_id):
+    """Read a job's status and progress from the shared store, or None."""
+    row = _progress_db().execute('SELECT * FROM job_progress WHERE job_id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    state = dict(row)
+    state['result'] = json.loads(state['result']) if state['result'] else None
+    state['metrics'] = json.loads(state['metrics']) if state['metrics'] else {}
+    return state
+
+def update_job_progress(job, percent, message="processing", rows_done=None, rows_total=None):
+    """Record a job's progress.
+    
+    Writes to the shared store are throttled to one per PROGRESS_WRITE_INTERVAL
+    (plus the final one), and each write also picks up cancel requests made
+    through another worker process.
+    """
+    job['percent'] = percent
+    job['message'] = message
+    if rows_done is not None:
+        job['rows_done'] = rows_done
+    if rows_total is not None:
+        job['rows_total'] = rows_total
+    
+    finished = percent >= 100 or (job['rows_total'] and job['rows_done'] >= job['rows_total'])
+    if not finished and time.time() - job['saved_at'] < PROGRESS_WRITE_INTERVAL:
+        return
+    save_job_state(job)
+    
+    row = _progress_db().execute('SELECT cancel_requested FROM job_progress WHERE job_id = ?',
+                                 (job['id'],)).fetchone()
+    if row is not None and row['cancel_requested']:
+        job['cancel_event'].set()
+
+def progress_view(state):
+    """Build the progress report for a job: percent, rows, rows/sec and ETA."""
+    if state is None:
+        return {'percent': 0, 'status': 'idle'}
+    
+    rows_done = state['rows_done'] or 0
+    rows_total = state['rows_total'] or 0
+    rows_per_sec = None
+    eta_seconds = None
+    if state['started_at'] and rows_done:
+        elapsed = (state['finished_at'] or state['updated_at'] or time.time()) - state['started_at']
+        if elapsed > 0:
+            rows_per_sec = rows_done / elapsed
+            if not state['finished_at']:
+                eta_seconds = max(0, rows_total - rows_done) / rows_per_sec
+    
+    return {
+        'job_id': state['job_id'],
+        'percent': state['percent'] or 0,
+        'status': state['message'] if state['status'] == 'running' else state['status'],
+        'rows_done': rows_done,
+        'rows_total': rows_total,
+        'rows_per_sec': round(rows_per_sec, 2) if rows_per_sec is not None else None,
+        'eta_seconds': round(eta_seconds, 1) if eta_seconds is not None else None
+    }
+
+def _prune_jobs():
+    """Forget finished jobs older than JOB_RETENTION seconds and expired datasets."""
+    cutoff = time.time() - app.config['JOB_RETENTION']
+    with jobs_lock:
+        for job_id in [job_id for job_id, job in jobs.items()
+                       if job['finished_at'] and job['finished_at'] < cutoff]:
+            del jobs[job_id]
+    _progress_db().execute('DELETE FROM job_auto_fit_sizes WHERE job_id IN '
+                           '(SELECT job_id FROM job_progress WHERE finished_at < ?)', (cutoff,))
+    _progress_db().execute('DELETE FROM job_progress WHERE finished_at < ?', (cutoff,))
+    # Uploaded datasets nobody has used for DATASET_RETENTION seconds
+    dataset_cutoff = time.time() - app.config['DATASET_RETENTION']
+    for dataset_path in glob.glob(os.path.join(DATASETS_DIR, '*')):
+        try:
+            if os.path.getmtime(dataset_path) < dataset_cutoff:
+                os.remove(dataset_path)
+        except OSError:
+            pass
+    # Streaming downloads that were registered but never fetched
+    for spec_path in glob.glob(os.path.join(STREAMS_DIR, '*.json')):
+        try:
+            if os.path.getmtime(spec_path) < cutoff:
+                os.remove(spec_path)
+                _expire_stream_job(os.path.basename(spec_path)[:-len('.json')])
+        except OSError:
+            pass
+
+def _expire_stream_job(job_id):
+    """Mark a streaming download that was never fetched as cancelled, so it can be pruned."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is not None:
+        job['status'] = 'cancelled'
+        job['message'] = 'download expired'
+        job['finished_at'] = time.time()
+        save_job_state(job)
+    else:
+        # Registered by another worker process
+        _progress_db().execute("""
+            UPDATE job_progress SET status = 'cancelled', message = 'download expired',
+                                    finished_at = ?, updated_at = ?
+            WHERE job_id = ? AND finished_at IS NULL
+        """, (time.time(), time.time(), job_id))
+
+def create_job(kind, job_id=None):
+    """Register a new job and return it.
+    
+    Clients may supply their own job_id so they can watch progress of a
+    request they are still waiting on; otherwise one is generated.
+    """
+    _prune_jobs()
+    if not job_id or not str(job_id).isalnum() or len(job_id) > 64:
+        job_id = generate_unique_id(16)
+    job = {
+        'id': job_id,
+        'kind': kind,
+        'status': 'queued',
+        'message': 'queued',
+        'percent': 0,
+        'rows_done': 0,
+        'rows_total': 0,
+        'result': None,
+        'error': None,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        'saved_at': 0,
+        'metrics': {},
+        'cancel_event': threading.Event()
+    }
+    with jobs_lock:
+        jobs[job_id] = job
+    save_job_state(job)
+    return job
+
+def run_job(job, func, *args):
+    """Execute func(job, *args) and record its outcome on the job."""
+    if job['cancel_event'].is_set():
+        job['status'] = 'cancelled'
+        job['finished_at'] = time.time()
+        save_job_state(job)
+        return
+    
+    job['status'] = 'running'
+    job['started_at'] = time.time()
+    save_job_state(job)
+    try:
+        job['result'] = func(job, *args)
+        job['status'] = 'complete'
+    except JobCancelled:
+        print(f"Job {job['id']} cancelled")
+        job['status'] = 'cancelled'
     except Exception as e:
-        print(f"Error drawing image box: {str(e)}")
+        print(f"Error in job {job['id']}: {str(e)}")
+        job['error'] = str(e)
+        job['status'] = 'error'
+    finally:
+        job['finished_at'] = time.time()
+        save_job_state(job)
 
-@app.route('/preview_combined_images', methods=['POST'])
-def preview_combined_images():
-    """Process both text and image boxes in a single template"""
-    global preview_progress
-    reset_preview_progress()
-    update_preview_progress(5, "starting")
+def submit_job(kind, func, *args):
+    """Queue func(job, *args) on the background worker pool and return the job ID."""
+    job = create_job(kind)
+    job_executor.submit(run_job, job, func, *args)
+    return job['id']
+
+def job_to_dict(state):
+    """Return the JSON view of a job's stored state."""
+    return {
+        'job_id': state['job_id'],
+        'kind': state['kind'],
+        'status': state['status'],
+        'result': state['result'],
+        'error': state['error'],
+        'created_at': state['created_at'],
+        'started_at': state['started_at'],
+        'finished_at': state['finished_at'],
+        'progress': progress_view(state),
+        'metrics': state['metrics']
+    }
+
+@app.route('/jobs/<string:job_id>')
+def get_job(job_id):
+    """Return the status, progress, result and error of a background job"""
+    state = load_job_state(job_id)
+    if state is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    return jsonify(job_to_dict(state))
+
+@app.route('/jobs/<string:job_id>/auto_fit_sizes')
+def get_job_auto_fit_sizes(job_id):
+    """Return the font size each auto-fit box used per row, for rows ?start= to ?end="""
+    if load_job_state(job_id) is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    try:
+        start = max(0, int(request.args.get('start') or 0))
+        end = request.args.get('end')
+        end = int(end) if end is not None else None
+    except ValueError:
+        return jsonify({'error': 'Invalid row range'}), 400
+    rows = load_auto_fit_sizes(job_id, start, end)
+    return jsonify({'job_id': job_id,
+                    'rows': [{'row_index': row_index, 'sizes': sizes} for row_index, sizes in rows]})
+
+def format_sse(event, data):
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/jobs/<string:job_id>/events')
+def job_events(job_id):
+    """Stream a job's progress as Server-Sent Events
     
-    data = request.get_json()
+    Sends a 'progress' event whenever the job's progress changes and a final
+    'done' event with the full job status once it completes, fails or is
+    cancelled, then closes the stream.
+    """
+    def generate():
+        last_sent = None
+        last_write = time.time()
+        waited_since = time.time()
+        while True:
+            state = load_job_state(job_id)
+            if state is None:
+                # The client may connect before its synchronous request has registered the job
+                if time.time() - waited_since > JOB_EVENTS_WAIT_FOR_JOB:
+                    yield format_sse('done', {'job_id': job_id, 'status': 'error', 'error': f'Job not found: {job_id}'})
+                    return
+            else:
+                if state['status'] in ('complete', 'error', 'cancelled'):
+                    yield format_sse('progress', progress_view(state))
+                    yield format_sse('done', job_to_dict(state))
+                    return
+                
+                progress = progress_view(state)
+                if progress != last_sent:
+                    last_sent = progress
+                    last_write = time.time()
+                    yield format_sse('progress', progress)
+                elif time.time() - last_write > 15:
+                    # Comment line keeps proxies from closing an idle stream
+                    last_write = time.time()
+                    yield ": keep-alive\n\n"
+            
+            # Wake up as soon as this process saves new state; updates from
+            # other worker processes are picked up on the next poll
+            with job_progress_changed:
+                job_progress_changed.wait(JOB_EVENTS_POLL_INTERVAL)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<string:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Ask a background job to stop; rendering stops at the next row"""
+    state = load_job_state(job_id)
+    if state is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    
+    if state['status'] in ('queued', 'running'):
+        # The job may be running in another worker process, which picks this up from the store
+        _progress_db().execute('UPDATE job_progress SET cancel_requested = 1 WHERE job_id = ?', (job_id,))
+        job = jobs.get(job_id)
+        if job is not None:
+            job['cancel_event'].set()
+    return jsonify(job_to_dict(state))
+
+def parse_render_request(data, limit=None, output_defaults=None):
+    """Validate a render request body.
     
+    Returns ((template_path, plan, rows, output), None) on success, or
+    (None, error_response) where error_response is a (json, status) tuple
+    ready to return from a view. output is the request's 'output' options
+    resolved over output_defaults (DOWNLOAD_OUTPUT if None).
+    """
     if not data:
-        reset_preview_progress()
-        return jsonify({'error': 'No data received'}), 400
+        return None, (jsonify({'error': 'No data received'}), 400)
     
     template_filename = data.get('template')
-    csv_data = data.get('csv_data', [])
     boxes = data.get('text_boxes', [])
     
-    if not template_filename or not csv_data or not boxes:
-        reset_preview_progress()
-        return jsonify({'error': 'Missing required parameters'}), 400
+    try:
+        rows = get_request_rows(data, limit=limit)
+    except LookupError as e:
+        return None, (jsonify({'error': str(e)}), 404)
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'Invalid row range'}), 400)
+    
+    if not template_filename or not rows or not boxes:
+        return None, (jsonify({'error': 'Missing required parameters'}), 400)
     
     try:
-        template_path = os.path.join(app.config['UPLOAD_FOLDER'], template_filename)
-        if not os.path.exists(template_path):
-            reset_preview_progress()
-            return jsonify({'error': f'Template file not found: {template_filename}'}), 404
-        
-        update_preview_progress(10, "preparing")
-        
-        preview_dir = os.path.join('static', 'previews')
-        os.makedirs(preview_dir, exist_ok=True)
-        # Clear previous previews
-        clear_directory(preview_dir, pattern="preview_*.png")
-        
-        update_preview_progress(15, "loading template")
-        template_img = Image.open(template_path)
-        
-        # Generate preview images
-        preview_urls = []
-        max_previews = min(len(csv_data), 10) if len(csv_data) > 10 else len(csv_data)
+        plan = compile_render_plan(boxes)
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    
+    try:
+        output = parse_output_format(data.get('output'), output_defaults or app.config['DOWNLOAD_OUTPUT'])
+    except (TypeError, ValueError) as e:
+        return None, (jsonify({'error': f'Invalid output options: {e}'}), 400)
+    
+    template_path = os.path.join(app.config['UPLOAD_FOLDER'], template_filename)
+    if not os.path.exists(template_path):
+        return None, (jsonify({'error': f'Template file not found: {template_filename}'}), 404)
+    
+    return (template_path, plan, rows, output), None
+
+def _generate_previews(job, template_path, plan, csv_data, previews_url, output=None):
+    """Render preview images for the given rows and return their URLs."""
+    update_job_progress(job, 10, "preparing", rows_total=len(csv_data))
+    
+    preview_dir = os.path.join('static', 'previews')
+    os.makedirs(preview_dir, exist_ok=True)
+    # Clear previous previews
+    clear_directory(preview_dir, pattern="preview_*")
+    
+    update_job_progress(job, 15, "loading template")
+    template_img = load_template(template_path)
+    
+    # Generate preview images
+    preview_urls = []
+    max_previews = len(csv_data)
+    
+    update_job_progress(job, 20, "generating previews")
+    
+    for idx, image_data in render_rows(template_img, plan, csv_data, cancel_event=job['cancel_event'],
+                                       output=output, metrics=job['metrics'],
+                                       auto_fit_log=AutoFitLog(job['id'])):
+        # Calculate progress - spread from 20% to 90%
+        current_progress = 20 + (70 * ((idx + 1) / max_previews))
+        update_job_progress(job, current_progress, f"generated image {idx+1}/{max_previews}", rows_done=idx + 1)
         
-        update_preview_progress(20, "generating previews")
+        # Save preview image
+        preview_filename = f'preview_{idx}_{int(datetime.now().timestamp() * 1000)}{(output or OutputFormat()).extension}'
+        preview_path = os.path.join('static', 'previews', preview_filename)
+        with open(preview_path, 'wb') as f:
+            f.write(image_data)
         
-        for idx, row in enumerate(csv_data[:max_previews]):
-            # Calculate progress - spread from 20% to 90%
-            current_progress = 20 + (70 * (idx / max(1, max_previews - 1)))
-            update_preview_progress(current_progress, f"generating image {idx+1}/{max_previews}")
-            
-            # Create a copy of template for each row
-            img = template_img.copy()
-            # Ensure image is in RGB or RGBA mode for consistent processing
-            if img.mode not in ('RGB', 'RGBA'):
-                img = img.convert('RGBA')
-            draw = ImageDraw.Draw(img)
-            
-            # Process each box (can be text or image)
-            for box in boxes:
-                column = box.get('column')
-                
-                if column not in row:
-                    print(f"Warning: Column '{column}' not found in CSV row {idx}")
-                    continue
-                
-                x = float(box.get('x', 0))
-                y = float(box.get('y', 0))
-                width = float(box.get('width', 100))
-                height = float(box.get('height', 100))
-                
-                # Check if it's an image box
-                if box.get('isImage', False):
-                    image_url = row[column]
-                    if image_url:  # Only process if URL is provided
-                        try:
-                            # For image boxes, use the dedicated function
-                            result = draw_image_box(draw, box, image_url, img.width, img.height)
-                            if result:
-                                if len(result) == 3: # If mask is returned
-                                    overlay, pos, mask = result
-                                    # Ensure overlay is RGBA before pasting with mask
-                                    if overlay.mode != 'RGBA':
-                                        overlay = overlay.convert('RGBA')
-                                    # Paste using the mask
-                                    img.paste(overlay, pos, mask)
-                                else: # No mask
-                                    overlay, pos = result
-                                    # Ensure overlay is compatible with base image mode
-                                    if img.mode == 'RGBA' and overlay.mode != 'RGBA':
-                                        overlay = overlay.convert('RGBA')
-                                    elif img.mode == 'RGB' and overlay.mode != 'RGB':
-                                        overlay = overlay.convert('RGB')
-                                    img.paste(overlay, pos)
-                            else:
-                                # Draw error indication
-                                draw.rectangle([(x, y), (x + width, y + height)], outline='red', width=2)
-                                draw.text((x + 5, y + 5), "Image Error", fill='red', font=ImageFont.truetype(DEFAULT_FONT, 12))
-                        except Exception as e:
-                            print(f"Error drawing image from {image_url}: {str(e)}")
-                            # Draw error box
-                            draw.rectangle([(x, y), (x + width, y + height)], outline='red', width=2)
-                            draw.text((x + 5, y + 5), f"Error: {str(e)[:30]}...", fill='red', font=ImageFont.truetype(DEFAULT_FONT, 12))
-                else:
-                    # It's a text box
-                    if row[column]:  # Only draw if text is provided
-                        # Handle text styling
-                        font_size = int(box.get('fontSize', 24))
-                        font_family = box.get('fontFamily', 'Arial')
-                        # Convert hex to RGB color
-                        color_hex = box.get('color', '#000000')
-                        if not color_hex.startswith('#'):
-                            color_hex = '#000000'
-                        color = tuple(int(color_hex.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
-                        
-                        # Handle text styling
-                        bold = box.get('bold', False)
-                        italic = box.get('italic', False)
-                        underline = box.get('underline', False)
-                        align = box.get('align', 'left')
-                        
-                        # Create a modified box with all required parameters for draw_text_box
-                        text_box = {
-                            'x': x,
-                            'y': y,
-                            'width': width,
-                            'height': height,
-                            'fontSize': font_size,
-                            'fontFamily': font_family,
-                            'color': color_hex,
-                            'bold': str(bold).lower(),
-                            'italic': str(italic).lower(),
-                            'underline': str(underline).lower(),
-                            'align': align
-                        }
-                        
-                        draw_text_box(draw, text_box, row[column], img.width, img.height)
-            
-            # Save preview image
-            preview_filename = f'preview_{idx}_{int(datetime.now().timestamp() * 1000)}.png'
-            preview_path = os.path.join('static', 'previews', preview_filename)
-            img.save(preview_path)
+        # Add URL to list
+        preview_url = previews_url + preview_filename + f"?v={int(datetime.now().timestamp())}"
+        preview_urls.append(preview_url)
+    
+    update_job_progress(job, 100, "complete")
+    
+    return {
+        'preview_urls': preview_urls,
+        'message': f'Generated {len(preview_urls)} preview images'
+    }
+
+@app.route('/preview_combined_images', methods=['POST'])
+def preview_combined_images():
+    """Process both text and image boxes in a single template
+    
+    Pass 'background': true to get a job ID back immediately instead of
+    waiting for the previews. Synchronous callers may pass their own 'job_id'
+    to follow progress through /preview_progress while they wait. Encoder
+    settings default to the fast PREVIEW_OUTPUT unless 'output' is given.
+    """
+    data = request.get_json()
+    
+    # Previews are capped at 10 rows to keep the endpoint responsive
+    request_spec, error = parse_render_request(data, limit=10, output_defaults=app.config['PREVIEW_OUTPUT'])
+    if error:
+        return error
+    template_path, plan, csv_data, output = request_spec
+    
+    # Resolve the URL prefix here, since background threads have no request context
+    previews_url = url_for('static', filename='previews/', _external=False)
+    
+    if str_to_bool(data.get('background', False)):
+        job_id = submit_job('preview', _generate_previews, template_path, plan, csv_data, previews_url, output)
+        return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+    
+    job = create_job('preview', data.get('job_id'))
+    run_job(job, _generate_previews, template_path, plan, csv_data, previews_url, output)
+    if job['status'] != 'complete':
+        return jsonify({'error': job['error'] or 'Preview cancelled', 'job_id': job['id']}), 500
+    return jsonify(dict(job['result'], job_id=job['id']))
+
+def _render_batch(job, template_path, plan, rows, output=None):
+    """Render every row into a new download batch directory."""
+    # Create a directory to store the images with timestamp and unique ID
+    timestamp = int(datetime.now().timestamp())
+    unique_id = generate_unique_id()
+    download_dir = os.path.join('static', 'downloads', f'batch_{timestamp}_{unique_id}')
+    os.makedirs(download_dir, exist_ok=True)
+    
+    total_rows = len(rows)
+    update_job_progress(job, 10, "loading template", rows_total=total_rows)
+    template_img = load_template(template_path)
+    
+    start_time = time.time()
+    
+    try:
+        # Write each image as soon as it is rendered rather than holding the batch in memory
+        extension = (output or OutputFormat()).extension
+        for idx, image_data in render_rows(template_img, plan, rows, cancel_event=job['cancel_event'], output=output,
+                                           metrics=job['metrics'], auto_fit_log=AutoFitLog(job['id'])):
+            with open(os.path.join(download_dir, f'image_{idx+1}{extension}'), 'wb') as f:
+                f.write(image_data)
             
-            # Add URL to list
-            preview_url = url_for('static', filename=f'previews/{preview_filename}', _external=False) + f"?v={int(datetime.now().timestamp())}"
-            preview_urls.append(preview_url)
+            # Spread progress from 10% to 95%
+            current_progress = 10 + (85 * ((idx + 1) / total_rows))
+            update_job_progress(job, current_progress, f"rendered image {idx+1}/{total_rows}", rows_done=idx + 1)
+    except Exception:
+        # Don't leave a half-written batch behind
+        shutil.rmtree(download_dir, ignore_errors=True)
+        raise
+    
+    elapsed = time.time() - start_time
+    rows_per_second = total_rows / elapsed if elapsed > 0 else float(total_rows)
+    print(f"Rendered {total_rows} images in {elapsed:.2f}s ({rows_per_second:.1f} rows/s)")
+    
+    update_job_progress(job, 100, "complete")
+    
+    return {
+        'download_dir': download_dir,
+        'file_count': total_rows,
+        'timestamp': timestamp,
+        'unique_id': unique_id,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(rows_per_second, 2)
+    }
+
+@app.route('/render_batch', methods=['POST'])
+def render_batch():
+    """Start a background job that renders every row of a dataset into a download batch"""
+    data = request.get_json()
+    
+    request_spec, error = parse_render_request(data)
+    if error:
+        return error
+    template_path, plan, rows, output = request_spec
+    
+    job_id = submit_job('render_batch', _render_batch, template_path, plan, rows, output)
+    return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+
+def _copy_previews(job, preview_urls):
+    """Copy rendered previews into a new download batch directory."""
+    # Create a directory to store the images with timestamp and unique ID
+    timestamp = int(datetime.now().timestamp())
+    unique_id = generate_unique_id()
+    download_dir = os.path.join('static', 'downloads', f'batch_{timestamp}_{unique_id}')
+    os.makedirs(download_dir, exist_ok=True)
+    
+    # Copy each preview image to the download directory
+    file_paths = []
+    total_urls = len(preview_urls)
+    
+    update_job_progress(job, 15, "preparing files", rows_total=total_urls)
+    
+    for idx, url in enumerate(preview_urls):
+        check_job_cancelled(job)
         
-        update_preview_progress(95, "finalizing")
-        time.sleep(0.5)  # Short delay to ensure frontend gets final progress update
-        update_preview_progress(100, "complete")
+        # Calculate progress - spread from 15% to 85%
+        current_progress = 15 + (70 * (idx / max(1, total_urls - 1)))
+        update_job_progress(job, current_progress, f"preparing file {idx+1}/{total_urls}", rows_done=idx)
         
-        return jsonify({
-            'preview_urls': preview_urls,
-            'message': f'Generated {len(preview_urls)} preview images'
-        })
+        # Extract filename from URL
+        filename = os.path.basename(url.split('?')[0])
+        src_path = os.path.join('static', 'previews', filename)
         
-    except Exception as e:
-        print(f"Error generating preview: {str(e)}")
-        reset_preview_progress()
-        return jsonify({'error': str(e)}), 500
-
-def generate_unique_id(length=8):
-    """Generate a random string of fixed length."""
-    letters = string.ascii_lowercase + string.digits
-    return ''.join(random.choice(letters) for i in range(length))
+        # Create a more user-friendly filename, keeping the preview's format
+        dst_filename = f'image_{idx+1}{os.path.splitext(filename)[1]}'
+        dst_path = os.path.join(download_dir, dst_filename)
+        
+        # Copy the file
+        shutil.copy2(src_path, dst_path)
+        file_paths.append(dst_path)
+    
+    update_job_progress(job, 100, "complete", rows_done=total_urls)
+    
+    # Return the download directory information
+    return {
+        'download_dir': download_dir,
+        'file_count': len(file_paths),
+        'timestamp': timestamp,
+        'unique_id': unique_id
+    }
 
 @app.route('/download_individual', methods=['POST'])
 def download_individual():
-    """Download individual preview images"""
-    global download_progress
-    reset_download_progress()
-    update_download_progress(5, "starting")
+    """Download individual preview images
     
+    Pass 'background': true to get a job ID back immediately. Synchronous
+    callers may pass their own 'job_id' to follow /download_progress.
+    """
     data = request.get_json()
     
     if not data or 'preview_urls' not in data:
-        reset_download_progress()
         return jsonify({'error': 'No preview URLs provided'}), 400
     
     preview_urls = data.get('preview_urls', [])
     if not preview_urls:
-        reset_download_progress()
         return jsonify({'error': 'Empty preview URLs list'}), 400
     
+    if str_to_bool(data.get('background', False)):
+        job_id = submit_job('download_individual', _copy_previews, preview_urls)
+        return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+    
+    job = create_job('download_individual', data.get('job_id'))
+    run_job(job, _copy_previews, preview_urls)
+    if job['status'] != 'complete':
+        return jsonify({'error': job['error'] or 'Download cancelled', 'job_id': job['id']}), 500
+    return jsonify(dict(job['result'], job_id=job['id']))
+
+class ZipStreamBuffer:
+    """Write-only, non-seekable file object that collects zip output between yields.
+    
+    zipfile falls back to data descriptors when it can't seek, so each member
+    can be emitted as soon as it is written.
+    """
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self._offset
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        """Return and forget everything written since the last drain."""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def get_compression_level(value=None):
+    """Return a valid deflate level (0-9), falling back to ZIP_COMPRESSION_LEVEL."""
+    if value is None or value == '':
+        return app.config['ZIP_COMPRESSION_LEVEL']
+    return min(9, max(0, int(value)))
+
+def add_zip_member(zipf, arcname, data, compression_level, metrics):
+    """Add a member to an archive, storing already-compressed formats as-is.
+    
+    Records the archiving time and sizes in metrics. The first stored member
+    is also deflated once, off the archive, to estimate the time and bytes
+    that storing saves versus deflating everything.
+    """
+    extension = os.path.splitext(arcname)[1].lower()
+    if compression_level == 0 or extension in PRECOMPRESSED_EXTENSIONS:
+        compress_type, compresslevel = zipfile.ZIP_STORED, None
+    else:
+        compress_type, compresslevel = zipfile.ZIP_DEFLATED, compression_level
+    
+    start = time.perf_counter()
+    zipf.writestr(arcname, data, compress_type=compress_type, compresslevel=compresslevel)
+    elapsed = time.perf_counter() - start
+    compress_size = zipf.filelist[-1].compress_size
+    
+    metrics['zip_seconds'] = metrics.get('zip_seconds', 0) + elapsed
+    metrics['zip_bytes_in'] = metrics.get('zip_bytes_in', 0) + len(data)
+    metrics['zip_bytes_out'] = metrics.get('zip_bytes_out', 0) + compress_size
+    if compress_type == zipfile.ZIP_STORED:
+        metrics['zip_stored_files'] = metrics.get('zip_stored_files', 0) + 1
+        if 'zip_deflate_sample' not in metrics and data:
+            sample_start = time.perf_counter()
+            deflated_size = len(zlib.compress(data, compression_level or app.config['ZIP_COMPRESSION_LEVEL']))
+            metrics['zip_deflate_sample'] = {
+                'seconds_per_mb': (time.perf_counter() - sample_start) / (len(data) / 1e6),
+                'size_ratio': deflated_size / len(data)
+            }
+        sample = metrics.get('zip_deflate_sample')
+        if sample:
+            # What deflating this member would have cost and saved
+            metrics['zip_estimated_seconds_saved'] = metrics.get('zip_estimated_seconds_saved', 0) + \
+                sample['seconds_per_mb'] * len(data) / 1e6
+            metrics['zip_estimated_bytes_forgone'] = metrics.get('zip_estimated_bytes_forgone', 0) + \
+                int(len(data) * (1 - sample['size_ratio']))
+    else:
+        metrics['zip_deflated_files'] = metrics.get('zip_deflated_files', 0) + 1
+    metrics['zip_bytes_saved'] = metrics['zip_bytes_in'] - metrics['zip_bytes_out']
+
+def _stream_spec_path(job_id):
+    """Return where a pending zip stream's request is stored, or None for a bad ID."""
+    if not job_id or not str(job_id).isalnum():
+        return None
+    return os.path.join(STREAMS_DIR, f'{job_id}.json')
+
+@app.route('/render_zip', methods=['POST'])
+def render_zip():
+    """Register a streaming zip download of every row of a dataset
+    
+    Returns a job ID and a download URL; rendering starts when the URL is
+    fetched and each image is written into the response as soon as it is
+    rendered. Pass 'compression_level' (0-9) to override ZIP_COMPRESSION_LEVEL
+    and 'output' to override the DOWNLOAD_OUTPUT encoder settings.
+    """
+    data = request.get_json()
+    
+    # Validate now so the download URL never points at a request that can't render
+    _, error = parse_render_request(data)
+    if error:
+        return error
     try:
-        # Create a directory to store the images with timestamp and unique ID
-        timestamp = int(datetime.now().timestamp())
-        unique_id = generate_unique_id()
-        download_dir = os.path.join('static', 'downloads', f'batch_{timestamp}_{unique_id}')
-        os.makedirs(download_dir, exist_ok=True)
-        
-        update_download_progress(15, "preparing files")
-        
-        # Copy each preview image to the download directory
-        file_paths = []
-        total_urls = len(preview_urls)
-        
-        for idx, url in enumerate(preview_urls):
-            # Calculate progress - spread from 15% to 85%
-            current_progress = 15 + (70 * (idx / max(1, total_urls - 1)))
-            update_download_progress(current_progress, f"preparing file {idx+1}/{total_urls}")
-            
-            # Extract filename from URL
-            filename = os.path.basename(url.split('?')[0])
-            src_path = os.path.join('static', 'previews', filename)
-            
-            # Create a more user-friendly filename
-            dst_filename = f'image_{idx+1}.png'
-            dst_path = os.path.join(download_dir, dst_filename)
-            
-            # Copy the file
-            shutil.copy2(src_path, dst_path)
-            file_paths.append(dst_path)
-        
-        update_download_progress(90, "finalizing")
-        time.sleep(0.5)  # Short delay to ensure frontend gets final progress update
-        update_download_progress(100, "complete")
-        
-        # Return the download directory information
-        return jsonify({
-            'download_dir': download_dir,
-            'file_count': len(file_paths),
-            'timestamp': timestamp,
-            'unique_id': unique_id
-        })
-        
-    except Exception as e:
-        print(f"Error preparing downloads: {str(e)}")
-        reset_download_progress()
-        return jsonify({'error': str(e)}), 500
+        get_compression_level(data.get('compression_level'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid compression level'}), 400
+    
+    job = create_job('render_zip')
+    # Stored on disk so whichever worker serves the download can pick it up
+    spec = {key: data.get(key) for key in ('template', 'text_boxes', 'dataset_id', 'csv_data', 'start', 'end',
+                                           'compression_level', 'output')}
+    with open(_stream_spec_path(job['id']), 'w') as f:
+        json.dump(spec, f)
+    
+    return jsonify({
+        'job_id': job['id'],
+        'status': 'queued',
+        'download_url': url_for('download_zip', job_id=job['id'])
+    }), 202
+
+@app.route('/download_zip/<string:job_id>')
+def download_zip(job_id):
+    """Stream a zip of rendered images, writing each image as it is produced"""
+    spec_path = _stream_spec_path(job_id)
+    if spec_path is None:
+        return "Download not found", 404
+    # Each registered download can only be streamed once; renaming the spec
+    # claims it, so a concurrent request for the same URL gets a 404
+    claimed_path = f'{spec_path}.{os.getpid()}.{threading.get_ident()}.claimed'
+    try:
+        os.rename(spec_path, claimed_path)
+    except OSError:
+        return "Download not found", 404
+    try:
+        with open(claimed_path) as f:
+            data = json.load(f)
+    finally:
+        os.remove(claimed_path)
+    
+    request_spec, error = parse_render_request(data)
+    if error:
+        return error
+    template_path, plan, rows, output = request_spec
+    
+    job = jobs.get(job_id) or create_job('render_zip', job_id)
+    total_rows = len(rows)
+    compression_level = get_compression_level(data.get('compression_level'))
+    
+    def generate():
+        buffer = ZipStreamBuffer()
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        update_job_progress(job, 0, "rendering", rows_done=0, rows_total=total_rows)
+        try:
+            template_img = load_template(template_path)
+            with zipfile.ZipFile(buffer, 'w') as zipf:
+                for idx, image_data in render_rows(template_img, plan, rows, cancel_event=job['cancel_event'],
+                                                   output=output, metrics=job['metrics'],
+                                                   auto_fit_log=AutoFitLog(job['id'])):
+                    add_zip_member(zipf, f'image_{idx+1}{output.extension}', image_data, compression_level,
+                                   job['metrics'])
+                    yield buffer.drain()
+                    update_job_progress(job, 100 * (idx + 1) / total_rows,
+                                        f"streamed image {idx+1}/{total_rows}", rows_done=idx + 1)
+            # Central directory
+            yield buffer.drain()
+            job['status'] = 'complete'
+            job['result'] = {'file_count': total_rows}
+        except JobCancelled:
+            print(f"Job {job_id} cancelled")
+            job['status'] = 'cancelled'
+            # Closing the ZipFile wrote a central directory listing the images
+            # streamed so far, so the partial download is still a valid archive
+            yield buffer.drain()
+        except GeneratorExit:
+            # The client went away; stop rendering
+            job['status'] = 'cancelled'
+            raise
+        except Exception as e:
+            print(f"Error streaming zip file: {e}")
+            job['status'] = 'error'
+            job['error'] = str(e)
+            # Leave out the central directory and abort the response, so the
+            # client sees a failed transfer rather than a complete download
+            raise
+        finally:
+            job['finished_at'] = time.time()
+            save_job_state(job)
+    
+    zip_filename = f'images_{int(datetime.now().timestamp())}_{job_id}.zip'
+    return Response(stream_with_context(generate()), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={zip_filename}',
+                             'X-Accel-Buffering': 'no'})
 
 def delayed_file_cleanup(zip_path, download_dir, delay=30):
     """Clean up files after a delay to allow for re-downloads."""
@@ -636,7 +2779,10 @@ def delayed_file_cleanup(zip_path, download_dir, delay=30):
 
 @app.route('/download_batch/<int:timestamp>/<string:unique_id>')
 def download_batch(timestamp, unique_id):
-    """Serve a batch zip file for download with unique identifier"""
+    """Serve a batch zip file for download with unique identifier
+    
+    Accepts ?compression_level=0-9 to override ZIP_COMPRESSION_LEVEL.
+    """
     download_dir = os.path.join('static', 'downloads', f'batch_{timestamp}_{unique_id}')
     
     if not os.path.exists(download_dir):
@@ -649,13 +2795,17 @@ def download_batch(timestamp, unique_id):
     try:
         # Only create the zip if it doesn't already exist
         if not os.path.exists(zip_path):
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            compression_level = get_compression_level(request.args.get('compression_level'))
+            metrics = {}
+            with zipfile.ZipFile(zip_path, 'w') as zipf:
                 for root, dirs, files in os.walk(download_dir):
                     for file in files:
                         file_path = os.path.join(root, file)
                         arcname = os.path.relpath(file_path, download_dir)
-                        zipf.write(file_path, arcname=arcname)
-            print(f"Created zip file: {zip_path}")
+                        with open(file_path, 'rb') as f:
+                            add_zip_member(zipf, arcname, f.read(), compression_level, metrics)
+            print(f"Created zip file: {zip_path} ({metrics.get('zip_seconds', 0):.2f}s, "
+                  f"{metrics.get('zip_stored_files', 0)} stored, {metrics.get('zip_deflated_files', 0)} deflated)")
         else:
             print(f"Using existing zip file: {zip_path}")
         
@@ -679,42 +2829,21 @@ def clear_directory(directory_path, pattern="*.png"):
         except OSError as e:
             print(f"Error removing file {f}: {e.strerror}")
 
+@app.route('/cache_stats')
+def get_cache_stats():
+    """Return hit rates for the font, layout, glyph run, template, image and overlay caches and HTTP pool counters of this worker"""
+    return jsonify(collect_cache_stats())
+
 # Progress tracking routes
 @app.route('/preview_progress')
 def get_preview_progress():
-    """Return the current preview generation progress"""
-    return jsonify(preview_progress)
+    """Return the progress of the preview job given by ?job_id="""
+    return jsonify(progress_view(load_job_state(request.args.get('job_id', ''))))
 
 @app.route('/download_progress')
 def get_download_progress():
-    """Return the current download preparation progress"""
-    return jsonify(download_progress)
-
-# Reset preview progress
-def reset_preview_progress():
-    """Reset the preview progress to initial state"""
-    global preview_progress
-    preview_progress = {"percent": 0, "status": "idle"}
-
-# Reset download progress
-def reset_download_progress():
-    """Reset the download progress to initial state"""
-    global download_progress
-    download_progress = {"percent": 0, "status": "idle"}
-
-# Update preview progress
-def update_preview_progress(percent, status="processing"):
-    """Update the preview progress"""
-    global preview_progress
-    preview_progress["percent"] = percent
-    preview_progress["status"] = status
-
-# Update download progress
-def update_download_progress(percent, status="processing"):
-    """Update the download progress"""
-    global download_progress
-    download_progress["percent"] = percent
-    download_progress["status"] = status
+    """Return the progress of the download job given by ?job_id="""
+    return jsonify(progress_view(load_job_state(request.args.get('job_id', ''))))
 
 if __name__ == '__main__':
     # For development
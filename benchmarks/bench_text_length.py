@@ -0,0 +1,67 @@
+"""Time text measurement and wrapping with and without advance-width tables.
+
+Runs every font in static/fonts cold (fresh font objects, empty width
+cache) and prints the speedup of text_length over draw.textlength.
+
+    python benchmarks/bench_text_length.py
+"""
+import glob
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import app  # noqa: E402
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+FONT_SIZE = 28
+WRAP_WIDTH = 300
+
+def make_texts(count=1000):
+    rng = random.Random(3)
+    letters = 'abcdefghijklmnopqrstuvwxyzéèüABCDEFGHIJ'
+    words = [''.join(rng.choice(letters) for _ in range(rng.randint(2, 10))) for _ in range(3000)]
+    return [' '.join(rng.sample(words, rng.randint(3, 25))) for _ in range(count)]
+
+def textlength(draw, text, font):
+    return draw.textlength(text, font=font)
+
+def time_wrap(draw, font_path, texts, measure):
+    """Wrap every text with a fresh font, measuring with the given function."""
+    font = ImageFont.truetype(font_path, FONT_SIZE)
+    app._text_width_cache.clear()
+    original = app.text_length
+    app.text_length = measure
+    try:
+        start = time.perf_counter()
+        for text in texts:
+            app.wrap_text_to_width(draw, text, font, WRAP_WIDTH)
+        return time.perf_counter() - start
+    finally:
+        app.text_length = original
+
+def time_measure(draw, font_path, texts, measure):
+    font = ImageFont.truetype(font_path, FONT_SIZE)
+    start = time.perf_counter()
+    for text in texts:
+        measure(draw, text, font)
+    return time.perf_counter() - start
+
+def main():
+    texts = make_texts()
+    draw = ImageDraw.Draw(Image.new('RGB', (10, 10)))
+    print(f'{len(texts)} texts of 3-25 words, {FONT_SIZE}px, wrapped at {WRAP_WIDTH}px')
+    print(f'{"font":24}{"measure ms (before -> after)":>32}{"wrap ms (before -> after)":>32}')
+    for font_path in sorted(glob.glob(os.path.join(ROOT, 'static', 'fonts', '*.ttf'))):
+        measure_before = time_measure(draw, font_path, texts, textlength)
+        measure_after = time_measure(draw, font_path, texts, app.text_length)
+        wrap_before = time_wrap(draw, font_path, texts, textlength)
+        wrap_after = time_wrap(draw, font_path, texts, app.text_length)
+        print(f'{os.path.basename(font_path):24}'
+              f'{measure_before * 1e3:10.1f} -> {measure_after * 1e3:7.1f} ({measure_before / measure_after:5.1f}x)'
+              f'{wrap_before * 1e3:10.1f} -> {wrap_after * 1e3:7.1f} ({wrap_before / wrap_after:5.1f}x)')
+
+if __name__ == '__main__':
+    main()
@@ -374,7 +374,9 @@ document.addEventListener('DOMContentLoaded', () => {
             
             const data = await response.json();
             csvData = data.preview;
-            window.fullCsvData = data.all_data;
+            // Full data stays on the server; keep only its ID and row count
+            window.datasetId = data.dataset_id;
+            window.datasetTotalRows = data.total_rows;
             updateCsvPreview(data.columns, data.preview);
             updateColumnSelects(data.columns);
             
@@ -532,6 +534,7 @@ document.addEventListener('DOMContentLoaded', () => {
             document.getElementById('combinedBoldText').classList.toggle('active', box.dataset.bold === 'true');
             document.getElementById('combinedItalicText').classList.toggle('active', box.dataset.italic === 'true');
             document.getElementById('combinedUnderlineText').classList.toggle('active', box.dataset.underline === 'true');
+            document.getElementById('combinedAutoFit').checked = box.dataset.autoFit === 'true';
             
             // Update alignment buttons
             document.querySelectorAll('[data-align]').forEach(btn => {
@@ -575,6 +578,7 @@ document.addEventListener('DOMContentLoaded', () => {
         textBox.dataset.bold = 'false';
         textBox.dataset.italic = 'false';
         textBox.dataset.underline = 'false';
+        textBox.dataset.autoFit = document.getElementById('combinedAutoFit').checked.toString();
         textBox.dataset.align = 'left';
         textBox.dataset.width = '150';
         textBox.dataset.height = '60';
@@ -749,6 +753,12 @@ document.addEventListener('DOMContentLoaded', () => {
         updateBoxPreview(selectedBox);
     });
 
+    document.getElementById('combinedAutoFit').addEventListener('change', function() {
+        if (!selectedBox || selectedBox.dataset.type !== 'text') return;
+        
+        selectedBox.dataset.autoFit = this.checked.toString();
+    });
+
     // Font size controls
     document.getElementById('combinedIncreaseFontSize').addEventListener('click', () => {
         if (!selectedBox || selectedBox.dataset.type !== 'text') return;
@@ -863,6 +873,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     config.bold = box.dataset.bold === 'true';
                     config.italic = box.dataset.italic === 'true';
                     config.underline = box.dataset.underline === 'true';
+                    config.autoFit = box.dataset.autoFit === 'true';
                     config.align = box.dataset.align;
                 } else if (boxType === 'image') {
                     config.isImage = true;
@@ -871,31 +882,13 @@ document.addEventListener('DOMContentLoaded', () => {
                 return config;
             });
 
-            const formattedCsvData = window.fullCsvData || csvData;
-            const totalRecords = formattedCsvData.length;
-
-            // For faster preview generation, only request the first row's preview initially
-            const firstRowData = [formattedCsvData[0]];
-
-            // Function to poll progress
-            const checkProgress = async () => {
-                try {
-                    const progressResponse = await fetch('/preview_progress');
-                    if (progressResponse.ok) {
-                        const progressData = await progressResponse.json();
-                        updateProgress(progressData.percent, 'combinedProgressContainer');
-                        
-                        if (progressData.percent < 100) {
-                            setTimeout(checkProgress, 500); // Poll every 500ms
-                        }
-                    }
-                } catch (error) {
-                    console.error('Error checking progress:', error);
-                }
-            };
-
-            // Start progress polling
-            setTimeout(checkProgress, 500);
+            const datasetId = window.datasetId;
+            const totalRecords = window.datasetTotalRows;
+            // Progress is tracked per job, so pick the ID up front and follow its event stream while we wait
+            const previewJobId = generateJobId();
+            waitForJob(previewJobId, progress => {
+                updateProgress(progress.percent, 'combinedProgressContainer');
+            }).catch(error => console.error('Error following preview progress:', error));
 
             const response = await fetch('/preview_combined_images', {
                 method: 'POST',
@@ -904,22 +897,26 @@ document.addEventListener('DOMContentLoaded', () => {
                 },
                 body: JSON.stringify({
                     template: currentTemplate,
-                    csv_data: firstRowData,
+                    job_id: previewJobId,
+                    dataset_id: datasetId,
+                    // For faster preview generation, only request the first row's preview initially
+                    start: 0,
+                    end: 1,
                     text_boxes: boxConfigs
                 })
             });
 
             const data = await response.json();
             if (response.ok) {
-                // Store all CSV data for on-demand preview generation
-                window.allCsvData = formattedCsvData;
+                // Store the dataset reference for on-demand preview generation
+                window.previewDatasetId = datasetId;
                 window.previewBoxConfigs = boxConfigs;
                 window.currentTemplateFile = currentTemplate;
 
                 // Store first preview URL and show it
                 window.previewUrls = data.preview_urls;
                 window.currentPreviewIndex = 0;
-                window.totalRecords = formattedCsvData.length;
+                window.totalRecords = totalRecords;
 
                 // Hide the carousel and show the single preview container
                 const carousel = document.getElementById('combinedPreviewCarousel');
@@ -947,15 +944,15 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
 
                 // Update the counter
-                document.getElementById('totalImagesCount').textContent = formattedCsvData.length;
+                document.getElementById('totalImagesCount').textContent = totalRecords;
                 document.getElementById('currentImageInput').value = 1;
-                document.getElementById('currentImageInput').max = formattedCsvData.length;
+                document.getElementById('currentImageInput').max = totalRecords;
 
                 // Enable the download button
                 const downloadBtn = document.getElementById('combinedDownloadBtn');
                 downloadBtn.disabled = false;
 
-                displayStatus(`Preview generated. Total records: ${formattedCsvData.length}`);
+                displayStatus(`Preview generated. Total records: ${totalRecords}`);
             } else {
                 throw new Error(data.error);
             }
@@ -1020,9 +1017,6 @@ document.addEventListener('DOMContentLoaded', () => {
         statusDiv.textContent = `Generating preview for record ${index + 1}...`;
         
         try {
-            // Generate preview for the requested record
-            const recordData = [window.allCsvData[index]];
-            
             const response = await fetch('/preview_combined_images', {
                 method: 'POST',
                 headers: {
@@ -1030,7 +1024,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 },
                 body: JSON.stringify({
                     template: window.currentTemplateFile,
-                    csv_data: recordData,
+                    // Generate preview for the requested record
+                    dataset_id: window.previewDatasetId,
+                    start: index,
+                    end: index + 1,
                     text_boxes: window.previewBoxConfigs
                 })
             });
@@ -1066,9 +1063,43 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Random alphanumeric ID for jobs whose progress we want to follow
+    function generateJobId() {
+        return Array.from(crypto.getRandomValues(new Uint8Array(16)), b => (b % 36).toString(36)).join('');
+    }
+
+    // Follow a job's Server-Sent Events stream until it finishes and return its result
+    function waitForJob(jobId, onProgress = null) {
+        return new Promise((resolve, reject) => {
+            const events = new EventSource(`/jobs/${jobId}/events`);
+            events.addEventListener('progress', event => {
+                if (onProgress) {
+                    onProgress(JSON.parse(event.data));
+                }
+            });
+            events.addEventListener('done', event => {
+                events.close();
+                const job = JSON.parse(event.data);
+                if (job.status === 'complete') {
+                    resolve(job.result);
+                } else if (job.status === 'cancelled') {
+                    reject(new Error('Job was cancelled'));
+                } else {
+                    reject(new Error(job.error || 'Job failed'));
+                }
+            });
+            events.onerror = () => {
+                // The browser reconnects on its own unless the stream has been closed
+                if (events.readyState === EventSource.CLOSED) {
+                    reject(new Error('Lost connection while waiting for job'));
+                }
+            };
+        });
+    }
+
     // Download Images
     document.getElementById('combinedDownloadBtn').addEventListener('click', async () => {
-        if (!window.currentTemplateFile || !window.allCsvData || !window.previewBoxConfigs) {
+        if (!window.currentTemplateFile || !window.previewDatasetId || !window.previewBoxConfigs) {
             displayStatus('No preview data available to download', true);
             return;
         }
@@ -1081,86 +1112,39 @@ document.addEventListener('DOMContentLoaded', () => {
             displayStatus('Generating all images for download. This may take a moment...');
             showProgressBar('combinedDownloadProgress', true); // Start with indeterminate progress
 
-            // Function to poll download progress
-            const checkDownloadProgress = async () => {
-                try {
-                    const progressResponse = await fetch('/download_progress');
-                    if (progressResponse.ok) {
-                        const progressData = await progressResponse.json();
-                        
-                        // Scale down the progress - max 90% from server
-                        // This leaves room for the final step (initiating download)
-                        if (progressData.percent < 100) {
-                            const scaledPercent = progressData.percent * 0.9; // Scale to max 90%
-                            updateProgress(scaledPercent, 'combinedDownloadProgress');
-                            setTimeout(checkDownloadProgress, 500); // Poll every 500ms
-                        } else {
-                            // Still don't show 100% - wait for actual download to start
-                            updateProgress(95, 'combinedDownloadProgress');
-                        }
-                    }
-                } catch (error) {
-                    console.error('Error checking download progress:', error);
-                }
-            };
-
-            // Start progress polling
-            setTimeout(checkDownloadProgress, 500);
-
-            // Generate all previews
-            const response = await fetch('/preview_combined_images', {
+            // Register a streaming zip of every row of the dataset
+            const response = await fetch('/render_zip', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({
                     template: window.currentTemplateFile,
-                    csv_data: window.allCsvData,
+                    dataset_id: window.previewDatasetId,
                     text_boxes: window.previewBoxConfigs
                 })
             });
 
             if (!response.ok) {
                 const errorData = await response.json();
-                throw new Error(errorData.error || 'Failed to generate preview images');
+                throw new Error(errorData.error || 'Failed to render images');
             }
 
-            const data = await response.json();
-            
-            displayStatus(`Generated ${data.preview_urls.length} images. Preparing download...`);
-            updateProgress(96, 'combinedDownloadProgress');
-            
-            // Prepare images for individual download
-            const prepareResponse = await fetch('/download_individual', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    preview_urls: data.preview_urls
-                })
-            });
-
-            if (!prepareResponse.ok) {
-                const errorData = await prepareResponse.json();
-                throw new Error(errorData.error || 'Failed to prepare images for download');
-            }
+            // The zip is rendered while it downloads, so start the download right away
+            // and follow the job's progress until the last image has been sent
+            const jobData = await response.json();
+            window.location.href = jobData.download_url;
+            displayStatus('Download started. Images are added to the zip as they are rendered...');
 
-            const downloadData = await prepareResponse.json();
-            updateProgress(98, 'combinedDownloadProgress');
-            
-            // Short delay to show almost complete
-            await new Promise(resolve => setTimeout(resolve, 500));
+            const downloadData = await waitForJob(jobData.job_id, progress => {
+                updateProgress(progress.percent, 'combinedDownloadProgress');
+                if (progress.eta_seconds !== null && progress.eta_seconds !== undefined) {
+                    displayStatus(`Rendered ${progress.rows_done} of ${progress.rows_total} images (${progress.rows_per_sec} images/s, about ${Math.ceil(progress.eta_seconds)}s left)...`);
+                }
+            });
             
-            // Only set to 100% right before initiating download
             updateProgress(100, 'combinedDownloadProgress');
-            
-            // Initiate direct download of the prepared zip file
-            // Use both timestamp and unique_id in the URL
-            const downloadUrl = `/download_batch/${downloadData.timestamp}/${downloadData.unique_id}`;
-            window.location.href = downloadUrl;
-            
-            displayStatus(`Download initiated for ${downloadData.file_count} images.`);
+            displayStatus(`Download complete: ${downloadData.file_count} images.`);
 
             // Re-enable the button after a short delay to allow download to start
             setTimeout(() => {
@@ -0,0 +1,67 @@
+"""Rows drawn on a reused RowCanvas must be byte-identical to rows drawn on a fresh template copy."""
+import os
+import random
+import sys
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+BOXES = [
+    dict(column='name', x=10.5, y=10, width=300, height=60, fontSize=32, color='#ff0000', fontFamily='Arial',
+         bold=True, underline=True, align='center'),
+    dict(column='desc', x=20, y=90, width=250, height=200, fontSize=18, color='#000000',
+         fontFamily='Courier New', align='right'),
+    dict(column='price', x=330.25, y=40.75, width=120, height=50, fontSize=40, color='#2050a0',
+         fontFamily='Georgia', italic=True, autoFit=True),
+    dict(column='photo', x=300, y=120, width=140, height=110, isImage=True),
+    dict(column='logo', x=-20, y=250, width=90, height=90, isImage=True),
+]
+
+def image_bytes(size, mode, color):
+    buffer = BytesIO()
+    Image.new(mode, size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+IMAGES = app.PrefetchedImages({
+    'http://img/wide.png': image_bytes((400, 120), 'RGB', (30, 160, 90)),
+    'http://img/tall.png': image_bytes((60, 200), 'RGBA', (200, 40, 40, 140)),
+    'http://img/gone.png': RuntimeError('404'),
+})
+
+def make_template(mode):
+    rng = random.Random(mode)
+    template = Image.new('RGB', (460, 340))
+    # Noise, so restoring the wrong pixels can't go unnoticed
+    template.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                      for _ in range(460 * 340)])
+    if mode == 'RGBA':
+        template.putalpha(Image.linear_gradient('L').resize(template.size))
+    elif mode in ('P', 'L'):
+        template = template.convert(mode)
+    return app.to_working_mode(template)
+
+def make_rows(count=30):
+    rng = random.Random(7)
+    words = ['Widget', 'Gadget', 'Extra long product description', 'x', '€ 12,99', 'Ünïcödé', '']
+    urls = list(IMAGES) + ['']
+    return [{'name': ' '.join(rng.sample(words, rng.randint(0, 3))),
+             'desc': ' '.join(rng.choice(words) for _ in range(rng.randint(0, 12))),
+             'price': rng.choice(['', '9', '1,234.50 EUR', 'Sale! ' * 6]),
+             'photo': rng.choice(urls),
+             'logo': rng.choice(urls)}
+            for _ in range(count)]
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'P', 'L'])
+def test_row_canvas_matches_template_copy(mode):
+    template = make_template(mode)
+    plan = app.compile_render_plan(BOXES)
+    canvas = app.RowCanvas(template)
+    for idx, row in enumerate(make_rows()):
+        expected = app.render_row(template, plan, row, idx, IMAGES).tobytes()
+        # The canvas image is reused by the next row, so compare it straight away
+        actual = app.render_row(template, plan, row, idx, IMAGES, canvas=canvas).tobytes()
+        assert actual == expected, (idx, row)
@@ -0,0 +1,36 @@
+"""text_length's advance-width tables must give exactly what draw.textlength does."""
+import glob
+import os
+import random
+import sys
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'fonts')
+FONTS = sorted(os.path.basename(path) for path in glob.glob(os.path.join(FONTS_DIR, '*.ttf')))
+SIZES = [8, 13, 24, 57, 100]
+LATIN_1 = [chr(code) for code in range(0x20, 0x100) if chr(code).isprintable()]
+
+def random_texts(seed, count=40):
+    rng = random.Random(seed)
+    return [''.join(rng.choice(LATIN_1) for _ in range(rng.randint(1, 30))) for _ in range(count)]
+
+@pytest.mark.parametrize('font_name', FONTS)
+@pytest.mark.parametrize('fontmode', ['L', '1'])
+def test_text_length_matches_textlength(font_name, fontmode):
+    draw = ImageDraw.Draw(Image.new('RGB', (10, 10)))
+    draw.fontmode = fontmode
+    for size in SIZES:
+        font = ImageFont.truetype(os.path.join(FONTS_DIR, font_name), size)
+        for text in random_texts(f'{font_name}-{fontmode}-{size}') + ['AV To Wa', 'Ünïcödé façade', 'x']:
+            assert app.text_length(draw, text, font) == draw.textlength(text, font=font), (size, text)
+
+def test_text_length_falls_back_outside_latin_1():
+    draw = ImageDraw.Draw(Image.new('RGB', (10, 10)))
+    font = ImageFont.truetype(os.path.join(FONTS_DIR, 'Arial.ttf'), 24)
+    for text in ['', 'price €12', 'tab\there', 'Ωmega']:
+        assert app.text_length(draw, text, font) == draw.textlength(text, font=font)
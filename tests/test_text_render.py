@@ -0,0 +1,44 @@
+"""draw_text_line must draw the same pixels as ImageDraw.text.
+
+It reproduces ImageDraw.text's positioning and masks on top of the glyph-run
+cache, so a Pillow upgrade that changes how text is drawn shows up here.
+"""
+import itertools
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'fonts')
+FONTS = ['Arial.ttf', 'ArialBdIt.ttf', 'CourierNew.ttf', 'Georgia.ttf', 'TimesNewRoman.ttf', 'Verdana.ttf']
+POSITIONS = [(12, 8), (12.5, 8.25), (31.7, 5.9)]
+STROKE_WIDTHS = [0, 1, 2]
+CANVASES = {
+    'RGB': (240, 235, 220),
+    'RGBA': (240, 235, 220, 128),
+}
+TEXT = 'Fjord Wälder, 12.99 € «AV» gy'
+# Largest per-channel difference allowed between the two renderings
+TOLERANCE = 1
+
+def render(mode, draw_line):
+    image = Image.new(mode, (420, 70), CANVASES[mode])
+    draw_line(ImageDraw.Draw(image))
+    return image
+
+@pytest.mark.parametrize('font_name', FONTS)
+@pytest.mark.parametrize('mode', sorted(CANVASES))
+def test_draw_text_line_matches_draw_text(font_name, mode):
+    font = ImageFont.truetype(os.path.join(FONTS_DIR, font_name), 28)
+    for xy, stroke_width in itertools.product(POSITIONS, STROKE_WIDTHS):
+        expected = render(mode, lambda draw: draw.text(xy, TEXT, font=font, fill='#204080',
+                                                       stroke_width=stroke_width, stroke_fill='#204080'))
+        # Twice, so the second drawing comes from the glyph-run cache
+        for _ in range(2):
+            actual = render(mode, lambda draw: app.draw_text_line(draw, xy, TEXT, font, '#204080', stroke_width))
+            extrema = ImageChops.difference(actual, expected).getextrema()
+            assert max(high for _, high in extrema) <= TOLERANCE, (xy, stroke_width)
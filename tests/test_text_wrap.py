@@ -0,0 +1,63 @@
+"""wrap_text_to_width must break lines where measuring whole prefixes does."""
+import glob
+import os
+import random
+import sys
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'fonts')
+FONTS = sorted(os.path.basename(path) for path in glob.glob(os.path.join(FONTS_DIR, '*.ttf')))
+SIZES = [12, 31]
+WIDTHS = [60, 150, 333.5]
+
+def prefix_wrap(draw, text, font, max_width):
+    """The original wrapping: measure every candidate line and word prefix in full."""
+    words = text.split()
+    lines = []
+    current_line = []
+    for word in words:
+        if draw.textlength(' '.join(current_line + [word]), font=font) <= max_width:
+            current_line.append(word)
+        elif current_line:
+            lines.append(' '.join(current_line))
+            current_line = [word]
+        else:
+            current_chars = []
+            for char in word:
+                if draw.textlength(''.join(current_chars + [char]), font=font) <= max_width:
+                    current_chars.append(char)
+                elif current_chars:
+                    lines.append(''.join(current_chars))
+                    current_chars = [char]
+                else:
+                    lines.append(char)
+            if current_chars:
+                current_line = [''.join(current_chars)]
+    if current_line:
+        lines.append(' '.join(current_line))
+    return lines
+
+def random_texts(seed, count=10):
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,-éü'
+    texts = []
+    for _ in range(count):
+        words = [''.join(rng.choice(letters) for _ in range(rng.choice([1, 3, 5, 8, 12, 30])))
+                 for _ in range(rng.randint(1, 25))]
+        texts.append(' '.join(words))
+    return texts
+
+@pytest.mark.parametrize('font_name', FONTS)
+def test_wrap_matches_prefix_measuring(font_name):
+    draw = ImageDraw.Draw(Image.new('RGB', (10, 10)))
+    for size in SIZES:
+        font = ImageFont.truetype(os.path.join(FONTS_DIR, font_name), size)
+        for text in random_texts(f'{font_name}-{size}') + ['', '   ', 'W' * 40, 'A fairly long description text']:
+            for width in WIDTHS:
+                assert app.wrap_text_to_width(draw, text, font, width) == prefix_wrap(draw, text, font, width), \
+                    (size, width, text)